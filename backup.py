@@ -10,6 +10,8 @@ import os
 import re
 import smtplib
 import sqlite3
+import time
+from datetime import datetime, timezone
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -23,6 +25,15 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from openai import OpenAI
 
+import media
+import routing
+import tracing
+import warmup
+from lifecycle import TIMER_MAX_LATE_S, Lifecycle, TimerStore
+from logsetup import setup_logging
+from prefilter import PreFilter
+from reengage import NudgeStore
+
 # ---------------------------------------------------------------------------
 # Опциональные зависимости (Google)
 # ---------------------------------------------------------------------------
@@ -38,6 +49,7 @@ except ImportError:
 # ---------------------------------------------------------------------------
 API_TOKEN = os.getenv("API_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 ALERT_CHAT_ID_RAW = os.getenv("ALERT_CHAT_ID")
 EMAIL_FROM = os.getenv("EMAIL_FROM")
 EMAIL_TO = os.getenv("EMAIL_TO")
@@ -64,10 +76,7 @@ ALERT_CHAT_ID = int(ALERT_CHAT_ID_RAW)
 # ---------------------------------------------------------------------------
 # Логирование
 # ---------------------------------------------------------------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
@@ -77,6 +86,9 @@ client = OpenAI(api_key=OPENAI_API_KEY)
 bot = Bot(token=API_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+prefilter = PreFilter()  # стикеры, «ок», спам и повторы не доходят до OpenAI
+media_pipeline = media.MediaPipeline()  # фото/логотипы для vision-модели
+lifecycle = Lifecycle()  # SIGTERM: дождаться начатых ходов, закрыть БД
 
 # ---------------------------------------------------------------------------
 # Google Sheets
@@ -139,6 +151,18 @@ def init_db(path: Path = DB_PATH) -> sqlite3.Connection:
     return conn
 
 db = init_db()
+nudges = NudgeStore()  # тексты от офлайн-задачи reengage.py (общий файл NUDGES_DB)
+
+def last_seen(chat_id: int) -> float | None:
+    """Время последней реплики в архиве (epoch) — так же, как его видит reengage.py."""
+    row = db.execute("SELECT MAX(timestamp) FROM messages WHERE user_id = ?", (chat_id,)).fetchone()
+    if not row or row[0] is None:
+        return None
+    return datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+def close_db() -> None:
+    db.commit()
+    db.close()
 
 # ---------------------------------------------------------------------------
 # Отправка email-уведомлений
@@ -157,7 +181,7 @@ def send_email_alert(subject: str, body: str, images: Sequence[bytes] | None = N
             part.add_header("Content-Disposition", f"attachment; filename=img{idx}.jpg")
             msg.attach(part)
     try:
-        with smtplib.SMTP_SSL(SMTP_HOST, 465) as smtp:
+        with tracing.span("smtp"), smtplib.SMTP_SSL(SMTP_HOST, 465) as smtp:
             smtp.login(EMAIL_FROM, SMTP_PASSWORD)
             smtp.send_message(msg)
     except Exception as e:
@@ -168,18 +192,32 @@ def send_email_alert(subject: str, body: str, images: Sequence[bytes] | None = N
 # ---------------------------------------------------------------------------
 followup_tasks: dict[int, tuple[asyncio.Task | None, asyncio.Task | None]] = {}
 contact_tasks: dict[int, asyncio.Task] = {}
+# Время срабатывания ("<chat_id>:<kind>" -> epoch) на диске: рестарт не теряет напоминания
+timers = TimerStore(Path(RENDER_DATA_DIR) / "timers.json")
+
+async def send_followup(chat_id: int, text: str) -> None:
+    """Шлёт напоминание и дописывает его в историю: «хорошо» в ответ на него увидит
+    и предфильтр (как ответ на вопрос), и модель."""
+    await bot.send_message(chat_id, text)
+    state = dp.fsm.get_context(bot=bot, chat_id=chat_id, user_id=chat_id)
+    data = await state.get_data()
+    history = data.get("chat_history")
+    if history:
+        history.append({"role": "assistant", "content": text})
+        await state.update_data(chat_history=history)
 
-async def schedule_followup_30(chat_id: int):
+async def schedule_followup_30(chat_id: int, delay: float = 30):
     try:
-        await asyncio.sleep(30)
-        await bot.send_message(chat_id, "Проведем бесплатную экспертизу?")
+        await asyncio.sleep(delay)
+        await send_followup(chat_id, "Проведем бесплатную экспертизу?")
+        timers.discard(f"{chat_id}:followup_30")
     except asyncio.CancelledError:
         pass
 
-async def schedule_followup_180(chat_id: int):
+async def schedule_followup_180(chat_id: int, delay: float = 180):
     try:
-        await asyncio.sleep(180)
-        await bot.send_message(
+        await asyncio.sleep(delay)
+        await send_followup(
             chat_id,
             (
                 "Понимаю, мой ответ возможно вас не устроил. "
@@ -189,16 +227,72 @@ async def schedule_followup_180(chat_id: int):
                 "Согласитесь, вы же не хотите, чтобы вам врали?)"
             )
         )
+        timers.discard(f"{chat_id}:followup_180")
     except asyncio.CancelledError:
         pass
 
-async def schedule_contact_reminder(chat_id: int):
+async def schedule_contact_reminder(chat_id: int, delay: float = 3 * 24 * 3600):
     try:
-        await asyncio.sleep(3 * 24 * 3600)
-        await bot.send_message(chat_id, "Оставьте ваши контакты для связи, пожалуйста.")
+        await asyncio.sleep(delay)
+        text = (
+            nudges.take("telegram", chat_id, last_seen=last_seen(chat_id))
+            or "Оставьте ваши контакты для связи, пожалуйста."
+        )
+        await send_followup(chat_id, text)
+        timers.discard(f"{chat_id}:contact")
     except asyncio.CancelledError:
         pass
 
+TIMERS = {
+    "followup_30": (schedule_followup_30, 30),
+    "followup_180": (schedule_followup_180, 180),
+    "contact": (schedule_contact_reminder, 3 * 24 * 3600),
+}
+
+def start_timers(chat_id: int, due: dict[str, float]) -> None:
+    """Запускает напоминания (kind -> epoch срабатывания) и сохраняет их на диск."""
+    now = time.time()
+    timers.update({f"{chat_id}:{kind}": due_at for kind, due_at in due.items()})
+    tasks = {}
+    for kind, due_at in due.items():
+        tasks[kind] = asyncio.create_task(TIMERS[kind][0](chat_id, max(0.0, due_at - now)))
+    task30, task180 = followup_tasks.get(chat_id, (None, None))
+    followup_tasks[chat_id] = (tasks.get("followup_30", task30), tasks.get("followup_180", task180))
+    if "contact" in tasks:
+        contact_tasks[chat_id] = tasks["contact"]
+
+def cancel_timers(chat_id: int) -> None:
+    for t in followup_tasks.pop(chat_id, ()):
+        if t:
+            t.cancel()
+    task = contact_tasks.pop(chat_id, None)
+    if task:
+        task.cancel()
+    timers.discard(*(f"{chat_id}:{kind}" for kind in TIMERS))
+
+def stop_timer_tasks() -> None:
+    """При остановке: задачи отменяем, а timers.json не трогаем — после рестарта поднимутся."""
+    for pair in followup_tasks.values():
+        for t in pair:
+            if t:
+                t.cancel()
+    for task in contact_tasks.values():
+        task.cancel()
+
+def restore_timers() -> None:
+    """Поднимает напоминания, сохранённые до рестарта; сильно просроченные отбрасывает."""
+    now = time.time()
+    pending: dict[int, dict[str, float]] = {}
+    for key, due_at in timers.items():
+        chat_id, _, kind = key.partition(":")
+        if kind not in TIMERS or now - due_at > TIMER_MAX_LATE_S:
+            timers.discard(key)
+            continue
+        pending.setdefault(int(chat_id), {})[kind] = due_at
+    for chat_id, due in pending.items():
+        start_timers(chat_id, due)
+    logger.info("Restored follow-up timers for %d chats", len(pending))
+
 # ---------------------------------------------------------------------------
 # Системный prompt
 # ---------------------------------------------------------------------------
@@ -305,14 +399,7 @@ SYSTEM_PROMPT = (
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext) -> None:
     chat_id = message.chat.id
-    if chat_id in followup_tasks:
-        for t in followup_tasks[chat_id]:
-            if t:
-                t.cancel()
-        del followup_tasks[chat_id]
-    if chat_id in contact_tasks:
-        contact_tasks[chat_id].cancel()
-        del contact_tasks[chat_id]
+    cancel_timers(chat_id)
 
     history = [
         {"role": "system", "content": SYSTEM_PROMPT},
@@ -327,26 +414,38 @@ async def cmd_start(message: types.Message, state: FSMContext) -> None:
 @dp.message()
 async def handle(message: types.Message, state: FSMContext) -> None:
     chat_id = message.chat.id
-    user_text = (message.text or "").strip()
+    with tracing.turn("backup", user_id=chat_id), lifecycle.turn():
+        await _handle_turn(message, state, chat_id)
 
-    data = await state.get_data()
+async def _handle_turn(message: types.Message, state: FSMContext, chat_id: int) -> None:
+    user_text = (message.text or message.caption or "").strip()
+    with tracing.span("media"):
+        images = await media_pipeline.from_telegram(message)
+
+    with tracing.span("state.get_data"):
+        data = await state.get_data()
     msg_count = data.get("msg_count", 0) + 1
-    await state.update_data(msg_count=msg_count)
+    with tracing.span("state.update_data"):
+        await state.update_data(msg_count=msg_count)
 
     if msg_count == 3:
-        task30 = asyncio.create_task(schedule_followup_30(chat_id))
-        task180 = asyncio.create_task(schedule_followup_180(chat_id))
-        followup_tasks[chat_id] = (task30, task180)
-        contact_tasks[chat_id] = asyncio.create_task(schedule_contact_reminder(chat_id))
+        start_timers(chat_id, {kind: time.time() + delay for kind, (_, delay) in TIMERS.items()})
 
     # rest of logic unchanged up to assistant response
     if user_text.lower() in {"отправь данные", "отправить данные"}:
         # ...
         return
     history = data.get("chat_history") or [{"role": "system", "content": SYSTEM_PROMPT}]
-    history.append({"role": "user", "content": user_text})
-    await state.update_data(chat_history=history)
-    # db inserts omitted for brevity...
+    last_assistant = history[-1]["content"] if history[-1]["role"] == "assistant" else None
+    verdict = prefilter.check(chat_id, user_text, last_assistant, has_media=bool(images))
+    if verdict.action != "pass":
+        if verdict.reply:
+            await message.answer(verdict.reply)
+        return
+    user_text = prefilter.take_deferred(chat_id, user_text)
+
+    chosen = routing.route(user_text, history, OPENAI_MODEL, has_media=bool(images))
+    user_message = {"role": "user", "content": media.history_text(user_text, images)}
 
     match = PHONE_REGEX.search(user_text)
     if match:
@@ -355,24 +454,67 @@ async def handle(message: types.Message, state: FSMContext) -> None:
 
     # assistant call
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=history,
-            max_tokens=500,
-            temperature=0.9,
-        )
+        started = time.monotonic()
+        with tracing.span("openai"):
+            response = client.chat.completions.create(
+                model=chosen.model,
+                messages=media.with_images([*history, user_message], images),
+                max_tokens=500,
+                temperature=0.9,
+            )
+        routing.observe(chosen, time.monotonic() - started)
+        tracing.annotate(model=chosen.model, route=chosen.reason)
         reply = response.choices[0].message.content
     except Exception:
         reply = "Ошибка. Попробуйте позже."
-
-    history.append({"role": "assistant", "content": reply})
-    await state.update_data(chat_history=history)
+        prefilter.forget(chat_id)  # повторная отправка того же текста — не флуд
+
+    # Ход дописывается целиком: прерванный вызов не оставит вопроса без ответа
+    history.extend((user_message, {"role": "assistant", "content": reply}))
+    # Архив диалогов: по нему reengage.py готовит персональные напоминания
+    username = message.from_user.username if message.from_user else None
+    with tracing.span("db"):
+        db.executemany(
+            "INSERT INTO messages (user_id, username, role, message, image) VALUES (?, ?, ?, ?, ?)",
+            [
+                (chat_id, username, "user", user_text, images[0].data if images else None),
+                (chat_id, username, "assistant", reply, None),
+            ],
+        )
+        db.commit()
+    with tracing.span("state.update_data"):
+        await state.update_data(chat_history=history)
 
     await asyncio.sleep(1)
-    await message.answer(reply)
+    with tracing.span("message.answer"):
+        await message.answer(reply)
 
 # ---------------------------------------------------------------------------
 # Точка входа
 # ---------------------------------------------------------------------------
+async def main() -> None:
+    # Пробы поднимаются сразу, апдейты начинаем забирать только после прогрева
+    readiness = warmup.Readiness()
+    health = await warmup.serve_health(readiness)
+    await warmup.warm_up({
+        "openai": warmup.openai_check(client, OPENAI_MODEL),
+        "telegram": bot.get_me,
+        "tokenizer": warmup.tokenizer_check(OPENAI_MODEL, SYSTEM_PROMPT),
+        "media": warmup.executor_check(media_pipeline.executor),
+    }, readiness)
+    restore_timers()
+
+    lifecycle.on_stop(lambda: setattr(readiness, "ready", False))
+    lifecycle.on_stop(stop_timer_tasks)  # до закрытия db/nudges, которыми они пользуются
+    if health is not None:
+        lifecycle.on_flush("health", health.close)
+    lifecycle.on_flush("db", close_db)
+    lifecycle.on_flush("timers", timers.flush)
+    lifecycle.on_flush("nudges", nudges.close)
+    lifecycle.on_flush("media", media_pipeline.close)
+    lifecycle.on_flush("bot.session", bot.session.close)
+    await lifecycle.serve(dp.start_polling(bot, handle_signals=False))
+
 if __name__ == "__main__":
-    asyncio.run(dp.start_polling(bot))
+    tracing.start_profiler_from_env()
+    asyncio.run(main())
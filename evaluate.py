@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""Офлайн-оценка промптов и моделей: прогон диалогов по нескольким конфигурациям параллельно.
+
+    python evaluate.py --configs eval/configs.json --scenarios eval/scenarios.json --mock
+    python evaluate.py --configs eval/configs.json --archive /tmp/messages.db --archive-limit 50
+
+Диалоги — скриптовые сценарии или реплики клиентов из архива messages.db; ответы
+проверяются правилами (без «бот», приветствие, абзацы, призыв оставить телефон),
+плюс латентность и стоимость токенов по каждой конфигурации.
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from logsetup import setup_logging
+
+load_dotenv()
+
+# Цены за 1M токенов (вход, выход), USD; переопределяются EVAL_PRICES='{"gpt-4o": [2.5, 10]}'
+PRICES: dict[str, tuple[float, float]] = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    **{k: tuple(v) for k, v in json.loads(os.getenv("EVAL_PRICES", "{}")).items()},
+}
+
+
+# Первая реплика бота на /start (main.py, backup.py); диалог в проде всегда начинается с неё
+DEFAULT_START_PHRASE = (
+    "Здравствуйте! Пока я зову менеджера, ответьте на вопрос: "
+    "есть ли у вас уже название или логотип для вашего бизнеса?"
+)
+
+
+class Config(NamedTuple):
+    name: str
+    prompt: str
+    model: str
+    temperature: float
+    max_tokens: int
+    start_phrase: str | None  # None — диалог без стартовой реплики бота
+
+
+class Scenario(NamedTuple):
+    name: str
+    turns: list[str]  # реплики клиента по порядку
+
+# ---------------------------------------------------------------------------
+# Загрузка конфигураций и сценариев
+# ---------------------------------------------------------------------------
+def _read_constant(path: Path, name: str) -> str | None:
+    """Строковая константа модуля (без его импорта)."""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(t, ast.Name) and t.id == name for t in node.targets
+        ):
+            return ast.literal_eval(node.value)
+    return None
+
+
+def read_prompt(path: Path) -> str:
+    """Промпт из текстового файла или из SYSTEM_PROMPT в .py."""
+    if path.suffix != ".py":
+        return path.read_text(encoding="utf-8")
+    prompt = _read_constant(path, "SYSTEM_PROMPT")
+    if prompt is None:
+        raise ValueError(f"SYSTEM_PROMPT not found in {path}")
+    return prompt
+
+
+def read_start_phrase(item: dict, prompt_path: Path) -> str | None:
+    """start_phrase из конфига (null — без неё), иначе START_PHRASE из .py, иначе как в main.py."""
+    if "start_phrase" in item:
+        return item["start_phrase"] or None
+    if prompt_path.suffix == ".py":
+        phrase = _read_constant(prompt_path, "START_PHRASE")
+        if phrase is not None:
+            return phrase
+    return DEFAULT_START_PHRASE
+
+
+def load_configs(path: Path) -> list[Config]:
+    configs = []
+    for item in json.loads(path.read_text(encoding="utf-8")):
+        prompt_path = path.parent / item["prompt_file"]
+        configs.append(Config(
+            item["name"],
+            read_prompt(prompt_path),
+            item.get("model", "gpt-4o"),
+            float(item.get("temperature", 0.9)),
+            int(item.get("max_tokens", 500)),
+            read_start_phrase(item, prompt_path),
+        ))
+    return configs
+
+
+def load_scenarios(path: Path) -> list[Scenario]:
+    return [Scenario(s["name"], s["turns"]) for s in json.loads(path.read_text(encoding="utf-8"))]
+
+
+def load_archive(db_path: Path, limit: int, max_turns: int = 6) -> list[Scenario]:
+    """Реплики клиентов из архива как сценарии (ответы заново генерирует кандидат)."""
+    conn = sqlite3.connect(db_path)
+    users = conn.execute(
+        "SELECT user_id FROM messages WHERE role = 'user' AND message != '' "
+        "GROUP BY user_id HAVING COUNT(*) >= 2 ORDER BY MAX(timestamp) DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    scenarios = []
+    for (user_id,) in users:
+        rows = conn.execute(
+            "SELECT message FROM messages WHERE user_id = ? AND role = 'user' AND message != '' "
+            "ORDER BY timestamp, rowid LIMIT ?",
+            (user_id, max_turns),
+        ).fetchall()
+        scenarios.append(Scenario(f"archive:{user_id}", [r[0] for r in rows]))
+    conn.close()
+    return scenarios
+
+# ---------------------------------------------------------------------------
+# Правила
+# ---------------------------------------------------------------------------
+# Промпт сам велит говорить «…и бот подключит к диалогу менеджера» — эта фраза разрешена
+_BOT_RE = re.compile(r"\bбот(?!\s+подключит)\w*", re.IGNORECASE)
+_GREETING_RE = re.compile(r"^\s*Здравствуйте,\s+меня зовут", re.IGNORECASE)
+_MARKDOWN_RE = re.compile(r"(\*\*|__|^#{1,6}\s)", re.MULTILINE)
+_PHONE_CTA_RE = re.compile(r"(номер\w*\s+телефон|телефон\w*\s+номер|оставьте\s+(ваш\s+)?телефон|аккаунт\s+в\s+telegram)", re.IGNORECASE)
+PARAGRAPH_MIN_CHARS = 250
+
+
+def check_reply(reply: str, turn_index: int) -> dict[str, bool]:
+    checks = {
+        "no_bot": not _BOT_RE.search(reply),
+        "no_markdown": not _MARKDOWN_RE.search(reply),
+        "no_ponyatno": not reply.lstrip().lower().startswith("понятно"),
+        "paragraphs": len(reply) < PARAGRAPH_MIN_CHARS or "\n" in reply.strip(),
+    }
+    if turn_index == 0:
+        checks["greeting"] = bool(_GREETING_RE.search(reply))
+    return checks
+
+
+def check_dialog(replies: list[str]) -> dict[str, bool]:
+    return {"phone_cta": any(_PHONE_CTA_RE.search(r) for r in replies)}
+
+# ---------------------------------------------------------------------------
+# Мок-эндпоинт
+# ---------------------------------------------------------------------------
+class MockClient:
+    """Подменяет OpenAI: правдоподобная задержка, usage и ответы, близкие к правилам."""
+
+    def __init__(self, seed: int = 0) -> None:
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self._seed = seed
+
+    def _create(self, model: str, messages: list[dict], **params) -> SimpleNamespace:
+        rnd = random.Random(f"{self._seed}:{model}:{len(messages)}:{messages[-1]['content']}")
+        time.sleep(rnd.uniform(0.05, 0.3) * (0.4 if "mini" in model else 1.0))
+        first = sum(m["role"] == "user" for m in messages) == 1
+        content = (
+            ("Здравствуйте, меня зовут Алексей Баженов, я руководитель филиала BeBrand. Как к вам обращаться?\n\n"
+             if first else "")
+            + "Подскажите, на каких площадках планируете работать: сайт, маркетплейсы, соцсети?"
+            + ("\n\nНапишите свой номер телефона, и бот подключит к диалогу менеджера по проверке названия."
+               if rnd.random() < 0.5 else "")
+        )
+        prompt_tokens = sum(len(str(m["content"])) for m in messages) // 3
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 3),
+        )
+
+# ---------------------------------------------------------------------------
+# Прогон
+# ---------------------------------------------------------------------------
+class DialogResult(NamedTuple):
+    config: str
+    scenario: str
+    replies: list[str]
+    checks: dict[str, list[bool]]
+    latencies: list[float]
+    prompt_tokens: int
+    completion_tokens: int
+    error: str | None
+
+
+async def run_dialog(client, config: Config, scenario: Scenario, sem: asyncio.Semaphore) -> DialogResult:
+    history = [{"role": "system", "content": config.prompt}]
+    if config.start_phrase:
+        # Как после /start в ботах: первый ответ модели — уже второе сообщение с представлением
+        history.append({"role": "assistant", "content": config.start_phrase})
+    replies, latencies = [], []
+    checks: dict[str, list[bool]] = {}
+    prompt_tokens = completion_tokens = 0
+    error = None
+    for i, user_text in enumerate(scenario.turns):
+        history.append({"role": "user", "content": user_text})
+        try:
+            async with sem:  # ограничиваем число одновременных запросов, а не диалогов
+                started = time.monotonic()
+                resp = await asyncio.to_thread(
+                    client.chat.completions.create,
+                    model=config.model,
+                    messages=list(history),
+                    max_tokens=config.max_tokens,
+                    temperature=config.temperature,
+                )
+                latencies.append(time.monotonic() - started)
+        except Exception as e:
+            error = repr(e)
+            break
+        reply = resp.choices[0].message.content or ""
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            prompt_tokens += usage.prompt_tokens
+            completion_tokens += usage.completion_tokens
+        history.append({"role": "assistant", "content": reply})
+        replies.append(reply)
+        for name, ok in check_reply(reply, i).items():
+            checks.setdefault(name, []).append(ok)
+    if replies:
+        for name, ok in check_dialog(replies).items():
+            checks.setdefault(name, []).append(ok)
+    return DialogResult(
+        config.name, scenario.name, replies, checks, latencies, prompt_tokens, completion_tokens, error,
+    )
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(configs: list[Config], results: list[DialogResult]) -> list[dict]:
+    report = []
+    for config in configs:
+        rows = [r for r in results if r.config == config.name]
+        checks: dict[str, list[bool]] = {}
+        for r in rows:
+            for name, values in r.checks.items():
+                checks.setdefault(name, []).extend(values)
+        latencies = [x for r in rows for x in r.latencies]
+        p_in = sum(r.prompt_tokens for r in rows)
+        p_out = sum(r.completion_tokens for r in rows)
+        price_in, price_out = PRICES.get(config.model, (0.0, 0.0))
+        report.append({
+            "config": config.name,
+            "model": config.model,
+            "dialogs": len(rows),
+            "errors": sum(1 for r in rows if r.error),
+            "pass_rate": {name: round(sum(v) / len(v), 3) for name, v in sorted(checks.items())},
+            "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000),
+            "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000),
+            "prompt_tokens": p_in,
+            "completion_tokens": p_out,
+            "cost_usd": round((p_in * price_in + p_out * price_out) / 1_000_000, 4),
+        })
+    return report
+
+
+def print_report(report: list[dict]) -> None:
+    rules = sorted({name for row in report for name in row["pass_rate"]})
+    header = ["config", "model", "dialogs", *rules, "p50 ms", "p95 ms", "tok in", "tok out", "$"]
+    lines = [header]
+    for row in report:
+        lines.append([
+            row["config"], row["model"], str(row["dialogs"]),
+            *(f"{row['pass_rate'].get(rule, 0) * 100:.0f}%" for rule in rules),
+            str(row["latency_p50_ms"]), str(row["latency_p95_ms"]),
+            str(row["prompt_tokens"]), str(row["completion_tokens"]), f"{row['cost_usd']:.4f}",
+        ])
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    for line in lines:
+        print("  ".join(cell.ljust(w) for cell, w in zip(line, widths)))
+
+
+async def evaluate(client, configs: list[Config], scenarios: list[Scenario], concurrency: int) -> list[DialogResult]:
+    sem = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(run_dialog(client, c, s, sem) for c in configs for s in scenarios))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--configs", type=Path, required=True)
+    parser.add_argument("--scenarios", type=Path)
+    parser.add_argument("--archive", type=Path, help="messages.db для реплея реальных диалогов")
+    parser.add_argument("--archive-limit", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mock", action="store_true", help="локальный мок вместо OpenAI")
+    parser.add_argument("--json", type=Path, help="сохранить отчёт и ответы в JSON")
+    args = parser.parse_args()
+
+    setup_logging()
+    configs = load_configs(args.configs)
+    scenarios = load_scenarios(args.scenarios) if args.scenarios else []
+    if args.archive:
+        scenarios += load_archive(args.archive, args.archive_limit)
+    if not scenarios:
+        parser.error("nothing to evaluate: pass --scenarios and/or --archive")
+
+    client = MockClient() if args.mock else OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    started = time.monotonic()
+    results = asyncio.run(evaluate(client, configs, scenarios, args.concurrency))
+    report = summarize(configs, results)
+    print_report(report)
+    print(f"\n{len(results)} dialogs in {time.monotonic() - started:.1f}s")
+
+    if args.json:
+        args.json.write_text(json.dumps({
+            "report": report,
+            "dialogs": [r._asdict() for r in results],
+        }, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
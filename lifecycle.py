@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Корректная остановка при деплое: SIGTERM → прекратить приём → дождаться ходов → сбросить состояние.
+
+    lifecycle = Lifecycle()
+    lifecycle.on_flush("db", db.close)
+    ...
+    with lifecycle.turn():          # в хэндлере
+        ...
+    await lifecycle.serve(dp.start_polling(bot, handle_signals=False))
+
+Ходы, не успевшие за DRAIN_TIMEOUT_S, отменяются; история дописывается только
+целым ходом (вопрос + ответ), поэтому отменённый ход не оставляет «половинок».
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import inspect
+import json
+import logging
+import os
+import signal
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+DRAIN_TIMEOUT_S = float(os.getenv("DRAIN_TIMEOUT_S", "20"))  # Render ждёт 30 с до SIGKILL
+TIMER_MAX_LATE_S = float(os.getenv("TIMER_MAX_LATE_S", str(60 * 60)))  # сильнее просроченные не шлём
+
+logger = logging.getLogger("lifecycle")
+
+Hook = Callable[[], object]
+
+
+class Lifecycle:
+    def __init__(self, drain_timeout: float = DRAIN_TIMEOUT_S) -> None:
+        self.drain_timeout = drain_timeout
+        self.accepting = True
+        self._inflight: set[asyncio.Task] = set()
+        self._stop: list[Hook] = []
+        self._flush: list[tuple[str, Hook]] = []
+        self._shutdown: asyncio.Task | None = None
+
+    # --- регистрация -------------------------------------------------------
+    def on_stop(self, hook: Hook) -> None:
+        """Вызывается первым: прекратить приём апдейтов, снять готовность."""
+        self._stop.append(hook)
+
+    def on_flush(self, name: str, hook: Hook) -> None:
+        """Вызывается после дренажа, в порядке регистрации (sync или async)."""
+        self._flush.append((name, hook))
+
+    @contextlib.contextmanager
+    def turn(self) -> Iterator[None]:
+        """Отмечает текущую задачу как ход в работе — остановка её дождётся."""
+        task = asyncio.current_task()
+        if task is None:
+            yield
+            return
+        self._inflight.add(task)
+        try:
+            yield
+        finally:
+            self._inflight.discard(task)
+
+    # --- остановка ---------------------------------------------------------
+    def install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self._on_signal, sig)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows или не главный поток — останется KeyboardInterrupt
+
+    def _on_signal(self, sig: signal.Signals) -> None:
+        logger.info("Received %s, shutting down", sig.name)
+        self.stop_intake()
+
+    def stop_intake(self) -> None:
+        if not self.accepting:
+            return
+        self.accepting = False
+        for hook in self._stop:
+            try:
+                hook()
+            except Exception as e:
+                logger.warning("Stop hook %r failed: %r", hook, e)
+
+    async def serve(self, intake: Awaitable) -> None:
+        """Крутит приём апдейтов до сигнала, затем дренаж и сброс состояния."""
+        self.install_signal_handlers()
+        task = asyncio.ensure_future(intake)
+        self.on_stop(task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            if self.accepting:
+                raise  # отменили нас самих, а не приём
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self) -> None:
+        """Идемпотентна: повторные вызовы ждут ту же остановку."""
+        if self._shutdown is None:
+            self._shutdown = asyncio.ensure_future(self._run_shutdown())
+        await asyncio.shield(self._shutdown)
+
+    async def _run_shutdown(self) -> None:
+        started = time.monotonic()
+        self.stop_intake()
+        pending = set(self._inflight)
+        if pending:
+            logger.info("Draining %d in-flight turns (up to %.0fs)", len(pending), self.drain_timeout)
+            _, pending = await asyncio.wait(pending, timeout=self.drain_timeout)
+        if pending:
+            logger.warning("Cancelling %d turns that did not finish in time", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for name, hook in self._flush:
+            try:
+                result = hook()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error("Flush %s failed: %r", name, e)
+        logger.info("Shutdown complete in %.1fs", time.monotonic() - started)
+
+# ---------------------------------------------------------------------------
+# Отложенные действия, переживающие рестарт
+# ---------------------------------------------------------------------------
+class TimerStore:
+    """Ключ → время срабатывания (epoch) в JSON-файле; каждая запись атомарна.
+
+    Внутри event loop запись файла уходит в поток, а изменения за одну итерацию
+    цикла склеиваются в одну запись; flush() дожидается последней.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._writer: asyncio.Task | None = None
+        self._dirty = False
+        try:
+            self._due: dict[str, float] = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            self._due = {}
+        except ValueError as e:
+            logger.error("Broken timers file %s, starting empty: %s", path, e)
+            self._due = {}
+
+    def items(self) -> list[tuple[str, float]]:
+        return list(self._due.items())
+
+    def set(self, key: str, due_at: float) -> None:
+        self.update({key: due_at})
+
+    def update(self, due: dict[str, float]) -> None:
+        """Несколько таймеров — одна запись файла."""
+        self._due.update(due)
+        self._save()
+
+    def discard(self, *keys: str) -> None:
+        removed = [key for key in keys if self._due.pop(key, None) is not None]
+        if removed:
+            self._save()
+
+    def replace(self, due: dict[str, float]) -> None:
+        """Полный снимок при остановке — пишется сразу, без фоновой задачи."""
+        self._due = dict(due)
+        self._write(json.dumps(self._due))
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+
+    def _save(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(json.dumps(self._due))  # вне event loop (скрипты, тесты)
+            return
+        self._dirty = True
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._write_soon())
+
+    async def _write_soon(self) -> None:
+        await asyncio.sleep(0)  # склеиваем изменения текущей итерации цикла
+        while self._dirty:
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._write, json.dumps(self._due))
+            except OSError as e:
+                logger.error("Failed to save timers to %s: %s", self.path, e)
+
+    def _write(self, payload: str) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(payload, encoding="utf-8")
+        os.replace(tmp, self.path)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Общий пул вызовов OpenAI: синхронный клиент в потоках с ограничением параллелизма."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+
+from openai import OpenAI
+
+import routing
+import tracing
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+
+logger = logging.getLogger("llm")
+
+
+class LLMPool:
+    """Один клиент (keep-alive соединения) и один семафор на весь процесс.
+
+    Вызов уходит в поток, поэтому event loop не блокируется на время ответа модели.
+    """
+
+    def __init__(self, client: OpenAI, concurrency: int = LLM_CONCURRENCY) -> None:
+        self.client = client
+        self._sem = asyncio.Semaphore(concurrency)
+
+    async def complete(self, chosen: routing.Route, messages: list[dict], **params) -> str:
+        params.setdefault("max_tokens", 500)
+        params.setdefault("temperature", 0.9)
+        async with self._sem:
+            started = time.monotonic()
+            with tracing.span("openai"):
+                resp = await asyncio.to_thread(
+                    self.client.chat.completions.create,
+                    model=chosen.model,
+                    messages=messages,
+                    **params,
+                )
+            routing.observe(chosen, time.monotonic() - started)
+        tracing.annotate(model=chosen.model, route=chosen.reason)
+        return resp.choices[0].message.content or "…"
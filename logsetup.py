@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Неблокирующее логирование: QueueHandler на event loop, запись в stderr — в отдельном потоке.
+
+Записи — компактный JSON, длинные сообщения обрезаются, телефоны и токены маскируются,
+для шумных логгеров включается сэмплирование (LOG_SAMPLE="vk_bot.events=0.01,routing=0.2").
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_MAX_LEN = int(os.getenv("LOG_MAX_LEN", "500"))
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "vk_bot.events=0.01")
+LOG_QUEUE_SIZE = 10_000
+# Отчёты профилировщика и slow turn — многострочные сводки на килобайты, их не обрезаем
+LOG_NO_TRUNCATE = tuple(filter(None, os.getenv("LOG_NO_TRUNCATE", "tracing").split(",")))
+
+_PHONE_RE = re.compile(r"\+?\d[\d\s\-()]{7,}(\d{2})")
+_SECRET_RE = re.compile(r"\b(sk-[\w-]{10,}|vk1\.a\.[\w-]+|\d{6,}:[\w-]{30,})")
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+def _mask_phone(match: re.Match) -> str:
+    digits = sum(ch.isdigit() for ch in match.group(0))
+    return f"***{match.group(1)}" if digits >= 10 else match.group(0)  # даты и суммы не трогаем
+
+
+def redact(text: str) -> str:
+    text = _SECRET_RE.sub("***", text)
+    return _PHONE_RE.sub(_mask_phone, text)
+
+
+def _clip(record: logging.LogRecord, msg: str, marker: str) -> str:
+    """Сначала маскирует, потом обрезает: иначе телефон на границе остался бы открытым."""
+    msg = redact(msg)
+    if len(msg) <= LOG_MAX_LEN or any(
+        record.name == name or record.name.startswith(name + ".") for name in LOG_NO_TRUNCATE
+    ):
+        return msg
+    return msg[:LOG_MAX_LEN] + marker.format(len(msg) - LOG_MAX_LEN)
+
+
+def _parse_rates(spec: str) -> dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+# ---------------------------------------------------------------------------
+# Горячий путь (поток event loop): фильтр + постановка в очередь
+# ---------------------------------------------------------------------------
+class SamplingFilter(logging.Filter):
+    """Пропускает долю записей INFO/DEBUG заданных логгеров (и их потомков); WARNING+ — всегда."""
+
+    def __init__(self, rates: dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+        self._cache: dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate, probe = 1.0, name
+            while probe:
+                if probe in self.rates:
+                    rate = self.rates[probe]
+                    break
+                probe = probe.rpartition(".")[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Не форматирует запись на горячем пути, если её аргументы неизменяемы.
+
+    Стандартный QueueHandler.prepare() вызывает полный форматтер в потоке
+    вызывающего; здесь форматирование и JSON уходят в поток слушателя.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # traceback нельзя безопасно отдавать в другой поток — форматируем здесь
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(a, _IMMUTABLE) for a in args)):
+            # изменяемые объекты могут поменяться до записи — фиксируем строку сейчас
+            record.msg = record.getMessage()[:LOG_MAX_LEN * 2]
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # лучше потерять строку лога, чем задержать ответ клиенту
+
+# ---------------------------------------------------------------------------
+# Поток слушателя: форматирование, обрезка, маскирование
+# ---------------------------------------------------------------------------
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "lvl": record.levelname,
+            "log": record.name,
+            "msg": _clip(record, record.getMessage(), "…(+{})"),
+        }
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, separators=(",", ":"))
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = _clip(record, record.message, "…")
+        return super().formatMessage(record)
+
+
+def setup_logging(level: str = LOG_LEVEL) -> QueueListener:
+    """Заменяет logging.basicConfig: корневой логгер пишет в очередь, stderr — в фоновом потоке."""
+    q: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    listener = QueueListener(q, stream, respect_handler_level=False)
+
+    handler = _NonBlockingQueueHandler(q)
+    handler.addFilter(SamplingFilter(_parse_rates(LOG_SAMPLE)))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
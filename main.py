@@ -6,6 +6,7 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
+import time
 
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
@@ -14,6 +15,14 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from openai import OpenAI
 
+import media
+import routing
+import tracing
+import warmup
+from lifecycle import Lifecycle
+from logsetup import setup_logging
+from prefilter import PreFilter
+
 # ---------------------------------------------------------------------------
 # .env и конфиг
 # ---------------------------------------------------------------------------
@@ -30,7 +39,7 @@ if _missing:
 # ---------------------------------------------------------------------------
 # Логирование
 # ---------------------------------------------------------------------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
@@ -44,6 +53,15 @@ oa_client = OpenAI(api_key=OPENAI_API_KEY)
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher(storage=MemoryStorage())
 
+# Отсекает стикеры, «ок», спам и повторы до вызова OpenAI
+prefilter = PreFilter()
+
+# Фото/логотипы: уменьшение в пуле потоков и кэш по хэшу
+media_pipeline = media.MediaPipeline()
+
+# SIGTERM при деплое: дождаться начатых ходов и только потом выйти
+lifecycle = Lifecycle()
+
 # ---------------------------------------------------------------------------
 # Системный промпт (можно сократить под себя)
 # ---------------------------------------------------------------------------
@@ -180,31 +198,72 @@ async def cmd_start(message: types.Message, state: FSMContext) -> None:
 # ---------------------------------------------------------------------------
 @dp.message()
 async def handle(message: types.Message, state: FSMContext) -> None:
-    user_text = (message.text or "").strip()
-    data = await state.get_data()
-    history = data.get("chat_history") or [{"role": "system", "content": SYSTEM_PROMPT}]
-    history.append({"role": "user", "content": user_text})
-
-    try:
-        resp = oa_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=history,
-            max_tokens=500,
-            temperature=0.9,
-        )
-        reply = resp.choices[0].message.content or "…"
-    except Exception:
-        logging.exception("OpenAI API error")
-        reply = "Сервис временно недоступен, попробуем ещё раз позже."
-
-    history.append({"role": "assistant", "content": reply})
-    await state.update_data(chat_history=history)
-    await asyncio.sleep(0)
-    await message.answer(reply)
+    with tracing.turn("main", user_id=message.chat.id), lifecycle.turn():
+        user_text = (message.text or message.caption or "").strip()
+        with tracing.span("media"):
+            images = await media_pipeline.from_telegram(message)
+        with tracing.span("state.get_data"):
+            data = await state.get_data()
+        history = data.get("chat_history") or [{"role": "system", "content": SYSTEM_PROMPT}]
+        last_assistant = history[-1]["content"] if history[-1]["role"] == "assistant" else None
+        verdict = prefilter.check(message.chat.id, user_text, last_assistant, has_media=bool(images))
+        if verdict.action != "pass":
+            if verdict.reply:
+                await message.answer(verdict.reply)
+            return
+        user_text = prefilter.take_deferred(message.chat.id, user_text)
+
+        chosen = routing.route(user_text, history, OPENAI_MODEL, has_media=bool(images))
+        user_message = {"role": "user", "content": media.history_text(user_text, images)}
+
+        try:
+            started = time.monotonic()
+            with tracing.span("openai"):
+                resp = oa_client.chat.completions.create(
+                    model=chosen.model,
+                    messages=media.with_images([*history, user_message], images),
+                    max_tokens=500,
+                    temperature=0.9,
+                )
+            routing.observe(chosen, time.monotonic() - started)
+            tracing.annotate(model=chosen.model, route=chosen.reason)
+            reply = resp.choices[0].message.content or "…"
+        except Exception:
+            logging.exception("OpenAI API error")
+            reply = "Сервис временно недоступен, попробуем ещё раз позже."
+            prefilter.forget(message.chat.id)  # повторная отправка того же текста — не флуд
+
+        # Ход дописывается целиком: прерванный вызов не оставит вопроса без ответа
+        history.extend((user_message, {"role": "assistant", "content": reply}))
+        with tracing.span("state.update_data"):
+            await state.update_data(chat_history=history)
+        await asyncio.sleep(0)
+        with tracing.span("message.answer"):
+            await message.answer(reply)
 
 # ---------------------------------------------------------------------------
 # Точка входа
 # ---------------------------------------------------------------------------
+async def main() -> None:
+    # Пробы поднимаются сразу, апдейты начинаем забирать только после прогрева
+    readiness = warmup.Readiness()
+    health = await warmup.serve_health(readiness)
+    await warmup.warm_up({
+        "openai": warmup.openai_check(oa_client, OPENAI_MODEL),
+        "telegram": bot.get_me,
+        "tokenizer": warmup.tokenizer_check(OPENAI_MODEL, SYSTEM_PROMPT),
+        "media": warmup.executor_check(media_pipeline.executor),
+    }, readiness)
+
+    lifecycle.on_stop(lambda: setattr(readiness, "ready", False))
+    if health is not None:
+        lifecycle.on_flush("health", health.close)
+    lifecycle.on_flush("media", media_pipeline.close)
+    lifecycle.on_flush("bot.session", bot.session.close)
+    await lifecycle.serve(dp.start_polling(bot, handle_signals=False))
+
+
 if __name__ == "__main__":
     logger.info("Bot starting…")
-    asyncio.run(dp.start_polling(bot))
+    tracing.start_profiler_from_env()
+    asyncio.run(main())
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Картинки от клиентов (чаще всего логотип на бесплатную проверку) → vision-модель.
+
+Скачивание асинхронное, уменьшение и перекодирование — в пуле потоков/процессов,
+готовые варианты кэшируются по sha256 исходника: повторный логотип не обрабатывается заново.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import collections
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, NamedTuple
+
+import aiohttp
+
+import tracing
+
+# ---------------------------------------------------------------------------
+# Опциональные зависимости (Pillow)
+# ---------------------------------------------------------------------------
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None  # type: ignore
+    ImageOps = None  # type: ignore
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+MEDIA_ENABLED = os.getenv("MEDIA", "1") == "1"
+MEDIA_MAX_SIDE = int(os.getenv("MEDIA_MAX_SIDE", "1024"))
+MEDIA_JPEG_QUALITY = int(os.getenv("MEDIA_JPEG_QUALITY", "85"))
+MEDIA_MAX_DOWNLOAD = int(os.getenv("MEDIA_MAX_DOWNLOAD", str(20 * 1024 * 1024)))
+MEDIA_MAX_PER_TURN = int(os.getenv("MEDIA_MAX_PER_TURN", "3"))
+MEDIA_DETAIL = os.getenv("MEDIA_DETAIL", "low")  # low: фиксированная цена и быстрее ответ
+MEDIA_POOL = os.getenv("MEDIA_POOL", "thread")  # thread | process
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+MEDIA_CACHE_DIR = Path(os.getenv("MEDIA_CACHE_DIR", Path(os.getenv("RENDER_DATA_DIR", "/tmp")) / "media_cache"))
+MEDIA_RAW_MAX_BYTES = int(os.getenv("MEDIA_RAW_MAX_BYTES", str(2 * 1024 * 1024)))  # без Pillow крупнее не шлём
+MEDIA_MEMORY_CACHE = 256  # столько обработанных картинок держим в RAM
+
+IMAGE_MARK = "[клиент прислал изображение]"
+
+logger = logging.getLogger("media")
+
+
+class ProcessedImage(NamedTuple):
+    digest: str
+    data: bytes  # JPEG после уменьшения
+
+    def part(self) -> dict:
+        """Кусок content для chat.completions."""
+        b64 = base64.b64encode(self.data).decode("ascii")
+        url = f"data:{_mime(self.data) or 'image/jpeg'};base64,{b64}"
+        return {"type": "image_url", "image_url": {"url": url, "detail": MEDIA_DETAIL}}
+
+
+def _mime(data: bytes) -> str | None:
+    """Тип по сигнатуре — только форматы, которые принимает модель (HEIC и прочие — None)."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+# ---------------------------------------------------------------------------
+# Обработка (выполняется в пуле, функция должна быть picklable)
+# ---------------------------------------------------------------------------
+def downscale(raw: bytes, max_side: int = MEDIA_MAX_SIDE, quality: int = MEDIA_JPEG_QUALITY) -> bytes:
+    if Image is None:
+        return raw  # без Pillow отдаём как есть
+    with Image.open(io.BytesIO(raw)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            # Логотипы часто в PNG с прозрачностью — кладём на белый фон
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side))
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality, optimize=True)
+        return out.getvalue()
+
+# ---------------------------------------------------------------------------
+# Пайплайн с кэшем
+# ---------------------------------------------------------------------------
+class MediaPipeline:
+    def __init__(self, cache_dir: Path = MEDIA_CACHE_DIR, executor: Executor | None = None) -> None:
+        self.cache_dir = cache_dir
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        if executor is None:
+            pool_cls = ProcessPoolExecutor if MEDIA_POOL == "process" else ThreadPoolExecutor
+            executor = pool_cls(max_workers=MEDIA_WORKERS)
+        self.executor = executor
+        self._memory: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+        self._aliases: collections.OrderedDict[str, str] = collections.OrderedDict()  # id источника -> digest
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._session: aiohttp.ClientSession | None = None
+        self.stats: collections.Counter[str] = collections.Counter()
+
+    def _remember(self, digest: str, data: bytes) -> None:
+        self._memory[digest] = data
+        self._memory.move_to_end(digest)
+        while len(self._memory) > MEDIA_MEMORY_CACHE:
+            self._memory.popitem(last=False)
+
+    def _cached(self, digest: str) -> bytes | None:
+        data = self._memory.get(digest)
+        if data is not None:
+            self._memory.move_to_end(digest)
+            return data
+        path = self.cache_dir / f"{digest}.jpg"
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        self._remember(digest, data)
+        return data
+
+    async def prepare(self, source_id: str, fetch: Callable[[], Awaitable[bytes]]) -> ProcessedImage | None:
+        """Возвращает уменьшенную картинку; скачивает и обрабатывает только при промахе кэша."""
+        digest = self._aliases.get(source_id)
+        if digest is not None:
+            data = self._cached(digest)
+            if data is not None:
+                self.stats["alias_hit"] += 1
+                return ProcessedImage(digest, data)
+
+        with tracing.span("media.download"):
+            raw = await fetch()
+        if Image is None and (_mime(raw) is None or len(raw) > MEDIA_RAW_MAX_BYTES):
+            # Без Pillow перекодировать нечем: неподдерживаемый или крупный файл уронил бы весь ход
+            self.stats["skipped_raw"] += 1
+            logger.warning("Skipping attachment %s without Pillow (%d bytes)", source_id, len(raw))
+            return None
+        loop = asyncio.get_running_loop()
+        if len(raw) > 256 * 1024:
+            # sha256 отпускает GIL — крупный файл хэшируем вне event loop
+            digest = await loop.run_in_executor(None, _sha256, raw)
+        else:
+            digest = _sha256(raw)
+        self._aliases[source_id] = digest
+        while len(self._aliases) > MEDIA_MEMORY_CACHE * 16:
+            self._aliases.popitem(last=False)
+
+        data = self._cached(digest)
+        if data is not None:
+            self.stats["hash_hit"] += 1
+            return ProcessedImage(digest, data)
+
+        # Одна и та же картинка, пришедшая параллельно, обрабатывается один раз
+        pending = self._inflight.get(digest)
+        if pending is None:
+            pending = loop.run_in_executor(self.executor, downscale, raw)
+            self._inflight[digest] = pending
+            try:
+                with tracing.span("media.process"):
+                    data = await pending
+            finally:
+                self._inflight.pop(digest, None)
+            self.stats["processed"] += 1
+            self._remember(digest, data)
+            await loop.run_in_executor(self.executor, (self.cache_dir / f"{digest}.jpg").write_bytes, data)
+        else:
+            data = await pending
+        return ProcessedImage(digest, data)
+
+    async def download(self, url: str) -> bytes:
+        """Скачивает файл по ссылке, не больше MEDIA_MAX_DOWNLOAD байт."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        async with self._session.get(url) as resp:
+            resp.raise_for_status()
+            buf = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                buf.extend(chunk)
+                if len(buf) > MEDIA_MAX_DOWNLOAD:
+                    raise ValueError(f"Attachment is larger than {MEDIA_MAX_DOWNLOAD} bytes")
+            return bytes(buf)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        self.executor.shutdown(wait=False)
+
+    # --- источники ---------------------------------------------------------
+    async def from_telegram(self, message) -> list[ProcessedImage]:
+        """Фото или картинка-документ из сообщения aiogram."""
+        if not MEDIA_ENABLED:
+            return []
+        file = None
+        if message.photo:
+            file = message.photo[-1]  # самый большой размер
+        elif message.document and (message.document.mime_type or "").startswith("image/"):
+            file = message.document
+        if file is None or (file.file_size or 0) > MEDIA_MAX_DOWNLOAD:
+            return []
+
+        async def fetch() -> bytes:
+            buf = await message.bot.download(file.file_id, destination=io.BytesIO())
+            return buf.getvalue()
+
+        return await self._collect([(f"tg:{file.file_unique_id}", fetch)])
+
+    async def from_vk(self, message) -> list[ProcessedImage]:
+        """Фото из вложений сообщения vkbottle."""
+        if not MEDIA_ENABLED:
+            return []
+        sources = []
+        for att in message.attachments or []:
+            photo = getattr(att, "photo", None)
+            if photo is None or not photo.sizes:
+                continue
+            best = max(photo.sizes, key=lambda s: (s.width or 0) * (s.height or 0))
+            sources.append((f"vk:{photo.owner_id}_{photo.id}", lambda url=best.url: self.download(url)))
+        return await self._collect(sources[:MEDIA_MAX_PER_TURN])
+
+    async def _collect(self, sources: list[tuple[str, Callable[[], Awaitable[bytes]]]]) -> list[ProcessedImage]:
+        if not sources:
+            return []
+        results = await asyncio.gather(
+            *(self.prepare(source_id, fetch) for source_id, fetch in sources),
+            return_exceptions=True,
+        )
+        images = []
+        for res in results:
+            if isinstance(res, BaseException):
+                logger.error("Failed to prepare attachment: %s", res)
+            elif res is not None:
+                images.append(res)
+        return images
+
+# ---------------------------------------------------------------------------
+# Сборка хода
+# ---------------------------------------------------------------------------
+def history_text(user_text: str, images: list[ProcessedImage]) -> str:
+    """Что сохраняем в историю: сами картинки не копим, только отметку."""
+    if not images:
+        return user_text
+    return f"{IMAGE_MARK} {user_text}".strip()
+
+
+def with_images(history: list[dict], images: list[ProcessedImage]) -> list[dict]:
+    """Сообщения для модели: последняя реплика пользователя дополняется картинками."""
+    if not images:
+        return history
+    last = history[-1]
+    parts = [{"type": "text", "text": last["content"]}, *(img.part() for img in images)]
+    return [*history[:-1], {"role": last["role"], "content": parts}]
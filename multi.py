@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Мультитенантный режим: все региональные боты (Telegram и VK) в одном процессе и одном event loop."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from aiogram import Bot, Dispatcher, types
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.memory import MemoryStorage
+from openai import OpenAI
+from vkbottle.bot import Bot as VKBot, BotLabeler, Message as VKMessage, rules
+
+import media
+import routing
+import tracing
+import warmup
+from lifecycle import Lifecycle, TimerStore
+from llm import LLMPool
+from logsetup import setup_logging
+from prefilter import PreFilter
+from sessions import SessionManager
+from tenants import Tenant, load_tenants
+
+# ---------------------------------------------------------------------------
+# .env и конфиг
+# ---------------------------------------------------------------------------
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+TENANTS_DIR = Path(os.getenv("TENANTS_DIR", "tenants"))
+SESSIONS_DIR = Path(os.getenv("SESSIONS_DIR", Path(os.getenv("RENDER_DATA_DIR", "/tmp")) / "vk_sessions"))
+REMINDERS_PATH = Path(os.getenv("RENDER_DATA_DIR", "/tmp")) / "multi_reminders.json"
+
+if not OPENAI_API_KEY:
+    raise RuntimeError("Missing environment variables: OPENAI_API_KEY")
+
+# ---------------------------------------------------------------------------
+# Логирование
+# ---------------------------------------------------------------------------
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Общие ресурсы: пул LLM, предфильтр (ключи с id тенанта), FSM-хранилище
+# ---------------------------------------------------------------------------
+llm = LLMPool(OpenAI(api_key=OPENAI_API_KEY))
+prefilter = PreFilter()
+media_pipeline = media.MediaPipeline()
+dp = Dispatcher(storage=MemoryStorage())  # ключи FSM включают bot_id — тенанты изолированы
+lifecycle = Lifecycle()  # SIGTERM: дождаться начатых ходов всех тенантов, сбросить память на диск
+reminders = TimerStore(REMINDERS_PATH)  # "<tenant>:<user_id>" -> когда напомнить
+
+tenants = load_tenants(TENANTS_DIR, OPENAI_MODEL)
+tg_bots: dict[int, tuple[Bot, Tenant]] = {}  # bot.id -> (bot, tenant)
+vk_bots: dict[str, tuple[VKBot, Tenant, SessionManager]] = {}  # tenant.id -> ...
+
+QUOTA_REPLY = "Сервис временно недоступен, попробуем ещё раз позже."
+
+# ---------------------------------------------------------------------------
+# Общий ход диалога для любой платформы
+# ---------------------------------------------------------------------------
+async def answer_turn(
+    tenant: Tenant,
+    user_id: int,
+    history: list[dict],
+    user_text: str,
+    images: list[media.ProcessedImage],
+) -> str | None:
+    """Дописывает ход в history и возвращает текст ответа (None — отвечать не нужно)."""
+    key = (tenant.id, user_id)
+    last_assistant = history[-1]["content"] if history[-1]["role"] == "assistant" else None
+    verdict = prefilter.check(key, user_text, last_assistant, has_media=bool(images))
+    if verdict.action != "pass":
+        return verdict.reply
+
+    # Квота — до take_deferred: иначе отложенные «ок» пропали бы вместе с отказом
+    if not tenant.quota.allow():
+        logger.warning("Tenant %s is over quota", tenant.id)
+        prefilter.forget(key)  # текст не обслужен — повторная отправка не должна считаться повтором
+        return QUOTA_REPLY
+    user_text = prefilter.take_deferred(key, user_text)
+
+    chosen = routing.route(user_text, history, tenant.model, has_media=bool(images))
+    user_message = {"role": "user", "content": media.history_text(user_text, images)}
+    try:
+        reply = await llm.complete(chosen, media.with_images([*history, user_message], images))
+    except Exception:
+        logger.exception("OpenAI API error (tenant %s)", tenant.id)
+        reply = "Сервис временно недоступен, попробуем ещё раз позже."
+        prefilter.forget(key)  # повторная отправка того же текста — не флуд
+    # Ход дописывается целиком: прерванный вызов не оставит вопроса без ответа
+    history.extend((user_message, {"role": "assistant", "content": reply}))
+    return reply
+
+# ---------------------------------------------------------------------------
+# Telegram: один Dispatcher на все боты, тенант определяется по bot.id
+# ---------------------------------------------------------------------------
+@dp.message(Command("start"))
+async def tg_start(message: types.Message, state: FSMContext, bot: Bot) -> None:
+    _, tenant = tg_bots[bot.id]
+    tenant.touch(message.chat.id)
+    history = [tenant.system_message, {"role": "assistant", "content": tenant.start_phrase}]
+    await state.update_data(chat_history=history)
+    await message.answer(tenant.start_phrase)
+
+
+@dp.message()
+async def tg_handle(message: types.Message, state: FSMContext, bot: Bot) -> None:
+    _, tenant = tg_bots[bot.id]
+    with tracing.turn("multi", tenant=tenant.id, user_id=message.chat.id), lifecycle.turn():
+        tenant.touch(message.chat.id)
+        with tracing.span("media"):
+            images = await media_pipeline.from_telegram(message)
+        with tracing.span("state.get_data"):
+            data = await state.get_data()
+        history = data.get("chat_history") or [tenant.system_message]
+        user_text = (message.text or message.caption or "").strip()
+        reply = await answer_turn(tenant, message.chat.id, history, user_text, images)
+        if reply is None:
+            return
+        with tracing.span("state.update_data"):
+            await state.update_data(chat_history=history)
+        with tracing.span("message.answer"):
+            await message.answer(reply)
+
+# ---------------------------------------------------------------------------
+# VK: свой Bot и labeler на тенанта, память диалогов — в своём подкаталоге
+# ---------------------------------------------------------------------------
+def make_vk_bot(tenant: Tenant) -> VKBot:
+    sessions = SessionManager(tenant.prompt, tenant.start_phrase, SESSIONS_DIR / tenant.id)
+    labeler = BotLabeler()
+    labeler.vbml_ignore_case = True
+
+    @labeler.message(rules.PayloadRule({"command": "start"}))
+    @labeler.message(text=["начать", "start"])
+    async def vk_start(message: VKMessage):
+        tenant.touch(message.from_id)
+        history = sessions.get(message.from_id)
+        await message.answer(history[-1]["content"])
+
+    @labeler.message()
+    async def vk_handle(message: VKMessage):
+        user_id = message.from_id
+        with tracing.turn("multi", tenant=tenant.id, user_id=user_id), lifecycle.turn():
+            tenant.touch(user_id)
+            with tracing.span("media"):
+                images = await media_pipeline.from_vk(message)
+            history = sessions.get(user_id)
+            reply = await answer_turn(tenant, user_id, history, (message.text or "").strip(), images)
+            if reply is None:
+                return
+            with tracing.span("message.answer"):
+                await message.answer(reply)
+
+    bot = VKBot(token=tenant.token, labeler=labeler)
+    vk_bots[tenant.id] = (bot, tenant, sessions)
+    return bot
+
+# ---------------------------------------------------------------------------
+# Фоновые задачи: напоминания всех тенантов и обслуживание памяти VK
+# ---------------------------------------------------------------------------
+async def send_to(tenant: Tenant, user_id: int, text: str) -> None:
+    if tenant.platform == "telegram":
+        bot = next(b for b, t in tg_bots.values() if t is tenant)
+        await bot.send_message(user_id, text)
+    else:
+        bot, _, _ = vk_bots[tenant.id]
+        await bot.api.messages.send(
+            user_id=user_id,
+            message=text,
+            random_id=int(time.time() * 1000) % 2147483647,
+        )
+
+
+async def check_and_send_reminders():
+    """Раз в час отправляет напоминания клиентам всех тенантов, которые молчат дольше порога"""
+    while True:
+        await asyncio.sleep(60 * 60)
+        now = time.time()
+        for tenant in tenants:
+            if not tenant.reminder_message:
+                continue
+            for user_id, last_time in list(tenant.last_message_time.items()):
+                if now - last_time < tenant.reminder_after_s:
+                    continue
+                # Одно напоминание на период молчания: до нового сообщения клиент не отслеживается
+                tenant.last_message_time.pop(user_id, None)
+                try:
+                    await send_to(tenant, user_id, tenant.reminder_message)
+                    logger.info("Sent reminder to %s/%s", tenant.id, user_id)
+                except Exception as e:
+                    logger.error("Failed to send reminder to %s/%s: %s", tenant.id, user_id, e)
+
+
+async def sweep_sessions():
+    while True:
+        await asyncio.sleep(60)
+        for _, _, sessions in vk_bots.values():
+            try:
+                sessions.sweep()
+            except Exception as e:
+                logger.error("Error in sessions sweep: %s", e)
+
+
+def restore_reminders() -> None:
+    """Поднимает ожидающие напоминания тенантов, сохранённые при прошлой остановке"""
+    by_id = {tenant.id: tenant for tenant in tenants}
+    for key, due_at in reminders.items():
+        tenant_id, _, user_id = key.rpartition(":")
+        tenant = by_id.get(tenant_id)
+        if tenant is not None and tenant.reminder_message:
+            tenant.last_message_time.setdefault(int(user_id), due_at - tenant.reminder_after_s)
+
+
+def save_reminders() -> None:
+    reminders.replace({
+        f"{tenant.id}:{user_id}": last_time + tenant.reminder_after_s
+        for tenant in tenants if tenant.reminder_message
+        for user_id, last_time in tenant.last_message_time.items()
+    })
+
+# ---------------------------------------------------------------------------
+# Точка входа
+# ---------------------------------------------------------------------------
+async def main() -> None:
+    if not tenants:
+        raise RuntimeError(f"No tenants configured in {TENANTS_DIR}")
+    for tenant in tenants:
+        if tenant.platform == "telegram":
+            bot = Bot(token=tenant.token)
+            tg_bots[bot.id] = (bot, tenant)
+        else:
+            make_vk_bot(tenant)
+    logger.info("Serving %d telegram and %d vk tenants", len(tg_bots), len(vk_bots))
+
+    # Пробы поднимаются сразу, апдейты начинаем забирать только после прогрева всех ботов
+    readiness = warmup.Readiness()
+    health = await warmup.serve_health(readiness)
+    checks = {
+        "openai": warmup.openai_check(llm.client, OPENAI_MODEL),
+        "media": warmup.executor_check(media_pipeline.executor),
+    }
+    for bot, tenant in tg_bots.values():
+        checks[f"telegram:{tenant.id}"] = bot.get_me
+    for bot, tenant, _ in vk_bots.values():
+        checks[f"vk:{tenant.id}"] = bot.api.groups.get_by_id
+    for tenant in {t.prompt: t for t in tenants}.values():
+        checks[f"tokenizer:{tenant.id}"] = warmup.tokenizer_check(tenant.model, tenant.prompt)
+    await warmup.warm_up(checks, readiness)
+
+    restore_reminders()
+    background = [asyncio.create_task(check_and_send_reminders()), asyncio.create_task(sweep_sessions())]
+    intake = []
+    if tg_bots:
+        intake.append(dp.start_polling(*(b for b, _ in tg_bots.values()), handle_signals=False))
+    intake.extend(bot.run_polling() for bot, _, _ in vk_bots.values())
+
+    lifecycle.on_stop(lambda: setattr(readiness, "ready", False))
+    if health is not None:
+        lifecycle.on_flush("health", health.close)
+    lifecycle.on_stop(lambda: [task.cancel() for task in background])
+    for bot, tenant, sessions in vk_bots.values():
+        lifecycle.on_flush(f"sessions:{tenant.id}", sessions.flush)
+        lifecycle.on_flush(f"vk.http:{tenant.id}", bot.api.http_client.close)
+    lifecycle.on_flush("reminders", save_reminders)
+    lifecycle.on_flush("media", media_pipeline.close)
+    for bot, tenant in tg_bots.values():
+        lifecycle.on_flush(f"bot.session:{tenant.id}", bot.session.close)
+    await lifecycle.serve(asyncio.gather(*intake))
+
+
+if __name__ == "__main__":
+    logger.info("Multi-tenant bot starting…")
+    tracing.start_profiler_from_env()
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Дешёвый локальный предфильтр: отсекает сообщения, на которые не нужен вызов LLM."""
+
+from __future__ import annotations
+
+import collections
+import logging
+import os
+import re
+import time
+import unicodedata
+from typing import NamedTuple
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+PREFILTER_ENABLED = os.getenv("PREFILTER", "1") == "1"
+REPEAT_WINDOW_S = float(os.getenv("PREFILTER_REPEAT_WINDOW_S", "120"))  # тот же текст на ту же реплику бота
+REPEAT_BURST_S = float(os.getenv("PREFILTER_REPEAT_BURST_S", "15"))  # двойная отправка, пока бот отвечал
+SPAM_THRESHOLD = float(os.getenv("PREFILTER_SPAM_THRESHOLD", "3"))
+MAX_TRACKED = 50_000  # ограничение памяти под последние тексты/отложенные реплики
+STATS_EVERY = 100
+
+logger = logging.getLogger("prefilter")
+
+NON_TEXT_REPLY = "Напишите, пожалуйста, ваш вопрос текстом — так я смогу ответить точнее."
+
+# Короткие подтверждения: сами по себе ответа не требуют
+_ACK_RE = re.compile(
+    r"^(ок|окей|ok|okay|ага|угу|понял|поняла|понятно|ясно|хорошо|спасибо|спс|благодарю|\+|\+\+|👍|👌)[\s!.)]*$",
+    re.IGNORECASE,
+)
+# Ответы «да/нет» на разные вопросы бота повтором не считаются
+_YES_NO_RE = re.compile(r"^(да|нет|неа|конечно|давайте|можно|пока нет)[\s!.)]*$", re.IGNORECASE)
+# Одна ссылка целиком — одно совпадение (схема и домен не считаются дважды)
+_URL_RE = re.compile(
+    r"(?:https?://|www\.)\S+|\b[\w-]+\.(?:ru|com|net|org|info|xyz|top|club)\b(?:/\S*)?",
+    re.IGNORECASE,
+)
+URL_WEIGHT = 1.0  # одна ссылка (сайт клиента, t.me-аккаунт) сама по себе порог не переходит
+
+# Признаки спама для простого линейного классификатора: (регулярка, вес)
+_SPAM_FEATURES: list[tuple[re.Pattern, float]] = [
+    (re.compile(r"(заработ|доход от|пассивн\w+ доход|инвестиц|крипт|казино|ставк[иа]|бонус)", re.IGNORECASE), 2.0),
+    (re.compile(r"(подпишись|подписывайтесь|переходи|жми|розыгрыш|выиграл)", re.IGNORECASE), 1.5),
+]
+# Сокращатели ссылок учитываются только вместе со спам-словами
+_SHORTENER_RE = re.compile(r"(bit\.ly|clck\.ru)", re.IGNORECASE)
+
+
+class Verdict(NamedTuple):
+    action: str  # pass | reply | defer | drop
+    reason: str
+    reply: str | None = None
+
+# ---------------------------------------------------------------------------
+# Правила
+# ---------------------------------------------------------------------------
+def _is_emoji_only(text: str) -> bool:
+    return all(
+        unicodedata.category(ch) in ("So", "Sk", "Cf", "Mn") or ch.isspace() or ch in "()!.:;-"
+        for ch in text
+    )
+
+
+def spam_score(text: str) -> float:
+    score = URL_WEIGHT * min(len(_URL_RE.findall(text)), 3)
+    keywords = sum(weight for pattern, weight in _SPAM_FEATURES if pattern.search(text))
+    if keywords and _SHORTENER_RE.search(text):
+        keywords += 1.0
+    score += keywords
+    letters = [ch for ch in text if ch.isalpha()]
+    if len(letters) > 20 and sum(ch.isupper() for ch in letters) / len(letters) > 0.6:
+        score += 1.0  # КАПС
+    return score
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class PreFilter:
+    """Решает, нужен ли на сообщение вызов модели.
+
+    Ключ — любой хешируемый идентификатор диалога (user_id, (tenant, user_id)…).
+    Отложенные реплики (подтверждения, эмодзи) подклеиваются к следующему ходу.
+    """
+
+    def __init__(self) -> None:
+        self.stats: collections.Counter[str] = collections.Counter()
+        self._last: collections.OrderedDict = collections.OrderedDict()  # key -> (text, hash реплики бота, ts)
+        self._deferred: collections.OrderedDict = collections.OrderedDict()  # key -> list[str]
+        self._checked = 0
+
+    def _remember(self, store: collections.OrderedDict, key, value) -> None:
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > MAX_TRACKED:
+            store.popitem(last=False)
+
+    def check(self, key, text: str, last_assistant: str | None = None, has_media: bool = False) -> Verdict:
+        verdict = self._classify(key, text, last_assistant, has_media)
+        self._checked += 1
+        self.stats[verdict.reason] += 1
+        if verdict.action != "pass":
+            self.stats["llm_calls_saved"] += 1
+            logger.info("prefilter %s reason=%s", verdict.action, verdict.reason)
+        if verdict.action == "defer":
+            self._remember(self._deferred, key, [*self._deferred.get(key, []), text.strip()])
+        if self._checked % STATS_EVERY == 0:
+            logger.info("prefilter stats %s", dict(self.stats))
+        return verdict
+
+    def _classify(self, key, text: str, last_assistant: str | None, has_media: bool) -> Verdict:
+        if not PREFILTER_ENABLED:
+            return Verdict("pass", "disabled")
+        text = text.strip()
+        if not text:
+            if has_media:
+                return Verdict("pass", "media")
+            return Verdict("reply", "non_text", NON_TEXT_REPLY)  # стикер, голосовое и т.п.
+
+        # Повтор — тот же текст, что и предыдущий от клиента:
+        #  * реплика бота с тех пор не менялась (флуд) — в пределах REPEAT_WINDOW_S;
+        #  * вызов модели синхронный, поэтому двойная отправка доходит уже после ответа
+        #    на первую — её ловим по короткому окну REPEAT_BURST_S.
+        # Короткие «да»/«ок» на разные вопросы бота повтором не считаются; после ответа
+        # с ошибкой хэндлер вызывает forget(), и повторная отправка проходит.
+        now = time.monotonic()
+        norm, asked = _normalize(text), hash(last_assistant)
+        prev = self._last.get(key)
+        self._remember(self._last, key, (norm, asked, now))
+        if prev and prev[0] == norm:
+            elapsed = now - prev[2]
+            short_answer = bool(_ACK_RE.match(text) or _YES_NO_RE.match(text))
+            if prev[1] == asked and elapsed <= REPEAT_WINDOW_S:
+                return Verdict("drop", "repeat")
+            if not short_answer and elapsed <= REPEAT_BURST_S:
+                return Verdict("drop", "repeat")
+
+        if spam_score(text) >= SPAM_THRESHOLD:
+            return Verdict("drop", "spam")
+
+        # На прямой вопрос бота «ок»/«+» — это ответ, его должна увидеть модель
+        awaiting_answer = bool(last_assistant and last_assistant.rstrip().endswith("?"))
+        if not awaiting_answer and (_ACK_RE.match(text) or _is_emoji_only(text)):
+            return Verdict("defer", "ack")
+        return Verdict("pass", "ok")
+
+    def forget(self, key) -> None:
+        """Ход не обслужен (ошибка модели, квота) — повтор того же текста не отбрасываем."""
+        self._last.pop(key, None)
+
+    def take_deferred(self, key, text: str) -> str:
+        """Подклеивает отложенные реплики к тексту хода, который пойдёт в модель."""
+        pending = self._deferred.pop(key, None)
+        if not pending:
+            return text
+        return "\n".join([*pending, text])
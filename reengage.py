@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Офлайн-генерация персональных напоминаний для замолчавших клиентов.
+
+Запускается по cron в непиковые часы:
+
+    python reengage.py --source archive                # Telegram: архив messages.db
+    python reengage.py --source vk-sessions            # VK: выгруженные на диск диалоги
+    python reengage.py --source archive --mode mock-batch
+
+Готовые тексты складываются в NudgeStore; планировщики ботов забирают их
+в момент отправки без обращения к модели.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+import routing
+import sessions
+from llm import LLMPool
+from logsetup import setup_logging
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+load_dotenv()
+
+RENDER_DATA_DIR = Path(os.getenv("RENDER_DATA_DIR", "/tmp"))
+ARCHIVE_DB = Path(os.getenv("ARCHIVE_DB", RENDER_DATA_DIR / "messages.db"))
+NUDGES_DB = Path(os.getenv("NUDGES_DB", RENDER_DATA_DIR / "nudges.db"))
+SESSIONS_DIR = Path(os.getenv("SESSIONS_DIR", RENDER_DATA_DIR / "vk_sessions"))
+NUDGE_MODEL = os.getenv("NUDGE_MODEL", os.getenv("OPENAI_MODEL", "gpt-4o"))
+SILENT_AFTER_S = float(os.getenv("NUDGE_SILENT_AFTER_S", str(2 * 24 * 60 * 60)))  # готовим заранее, до 3 дней
+REMIND_AFTER_S = float(os.getenv("NUDGE_REMIND_AFTER_S", str(3 * 24 * 60 * 60)))  # когда боты шлют напоминание
+NUDGE_MAX_AGE_S = float(os.getenv("NUDGE_MAX_AGE_S", str(2 * 24 * 60 * 60)))
+NUDGE_CONCURRENCY = int(os.getenv("NUDGE_CONCURRENCY", "4"))  # скромно: не мешаем живому трафику
+OFFPEAK_HOURS = os.getenv("NUDGE_OFFPEAK_HOURS", "1-6")  # локальные часы, включительно
+HISTORY_TURNS = 8
+TURN_CHARS = 300
+
+logger = logging.getLogger("reengage")
+
+NUDGE_INSTRUCTIONS = (
+    "Ты менеджер компании BeBrand (защита товарных знаков). Клиент перестал отвечать. "
+    "По фрагменту диалога напиши одно короткое личное напоминание (до 400 знаков) на русском: "
+    "сошлись на то, что обсуждали (название, сферу, площадки), предложи бесплатную экспертизу "
+    "обозначения и попроси оставить номер телефона. Говори о себе в мужском роде, "
+    "не упоминай слово «бот», без форматирования и без приветствия по шаблону."
+)
+
+
+class DueUser(NamedTuple):
+    platform: str
+    user_id: int
+    last_seen: float
+    turns: list[dict]
+
+    @property
+    def custom_id(self) -> str:
+        return f"{self.platform}:{self.user_id}"
+
+# ---------------------------------------------------------------------------
+# Хранилище готовых напоминаний
+# ---------------------------------------------------------------------------
+class NudgeStore:
+    """SQLite-таблица заранее сгенерированных текстов: (platform, user_id) -> message."""
+
+    def __init__(self, path: Path = NUDGES_DB) -> None:
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS nudges (
+                platform TEXT,
+                user_id INTEGER,
+                last_seen REAL,
+                message TEXT,
+                created_at REAL,
+                sent_at REAL,
+                PRIMARY KEY (platform, user_id)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def save(self, user: DueUser, message: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO nudges VALUES (?, ?, ?, ?, ?, NULL)",
+            (user.platform, user.user_id, user.last_seen, message, time.time()),
+        )
+        self.conn.commit()
+
+    def prepared_for(self, platform: str) -> dict[int, float]:
+        """user_id -> last_seen, для которого текст уже готов или отправлен (повторно не генерируем)."""
+        rows = self.conn.execute(
+            "SELECT user_id, last_seen FROM nudges WHERE platform = ?", (platform,)
+        )
+        return dict(rows.fetchall())
+
+    def take(self, platform: str, user_id: int, last_seen: float | None = None) -> str | None:
+        """Забирает готовый текст, если он свежий и клиент с тех пор не писал."""
+        row = self.conn.execute(
+            "SELECT message, last_seen, created_at FROM nudges "
+            "WHERE platform = ? AND user_id = ? AND sent_at IS NULL",
+            (platform, user_id),
+        ).fetchone()
+        if row is None:
+            return None
+        message, nudge_seen, created_at = row
+        if time.time() - created_at > NUDGE_MAX_AGE_S:
+            return None
+        if last_seen is not None and last_seen - nudge_seen > 60:
+            return None  # диалог продолжился после генерации — текст устарел
+        self.conn.execute(
+            "UPDATE nudges SET sent_at = ? WHERE platform = ? AND user_id = ?",
+            (time.time(), platform, user_id),
+        )
+        self.conn.commit()
+        return message
+
+    def close(self) -> None:
+        self.conn.close()
+
+# ---------------------------------------------------------------------------
+# Источники замолчавших клиентов
+# ---------------------------------------------------------------------------
+def _utc(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def due_from_archive(
+    db_path: Path, silent_after: float, limit: int, remind_after: float = REMIND_AFTER_S,
+) -> list[DueUser]:
+    """Telegram: клиенты из архива messages.db, чьё напоминание ещё впереди.
+
+    Молчат дольше silent_after, но меньше remind_after — те, кто молчит дольше,
+    своё напоминание уже получили (или пропустили), тексты для них не нужны.
+    """
+    conn = sqlite3.connect(db_path)
+    now = time.time()
+    rows = conn.execute(
+        "SELECT user_id, MAX(timestamp) FROM messages GROUP BY user_id "
+        "HAVING MAX(timestamp) <= ? AND MAX(timestamp) > ? ORDER BY MAX(timestamp) DESC LIMIT ?",
+        (_utc(now - silent_after), _utc(now - remind_after), limit),
+    ).fetchall()
+    users = []
+    for user_id, last_ts in rows:
+        turns = conn.execute(
+            "SELECT role, message FROM messages WHERE user_id = ? AND message IS NOT NULL "
+            "ORDER BY timestamp DESC, rowid DESC LIMIT ?",
+            (user_id, HISTORY_TURNS),
+        ).fetchall()
+        last_seen = datetime.strptime(last_ts, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        users.append(DueUser(
+            "telegram", user_id, last_seen,
+            [{"role": role, "content": text} for role, text in reversed(turns)],
+        ))
+    conn.close()
+    return users
+
+
+def due_from_sessions(
+    directory: Path, silent_after: float, limit: int, remind_after: float = REMIND_AFTER_S,
+) -> list[DueUser]:
+    """VK: диалоги, выгруженные SessionManager на диск, чьё напоминание ещё впереди."""
+    now = time.time()
+    users = [
+        DueUser("vk", user_id, touched, turns[-HISTORY_TURNS:])
+        for user_id, touched, turns in sessions.iter_hibernated(directory)
+        if silent_after <= now - touched < remind_after and any(t["role"] == "user" for t in turns)
+    ]
+    users.sort(key=lambda u: u.last_seen, reverse=True)
+    return users[:limit]
+
+# ---------------------------------------------------------------------------
+# Компактный промпт
+# ---------------------------------------------------------------------------
+def build_messages(user: DueUser) -> list[dict]:
+    lines = []
+    for turn in user.turns:
+        who = "Клиент" if turn["role"] == "user" else "Менеджер"
+        text = " ".join(str(turn["content"]).split())
+        lines.append(f"{who}: {text[:TURN_CHARS]}")
+    return [
+        {"role": "system", "content": NUDGE_INSTRUCTIONS},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+
+# ---------------------------------------------------------------------------
+# Генерация: параллельными пачками или файловым batch-заданием
+# ---------------------------------------------------------------------------
+async def generate_parallel(users: list[DueUser], store: NudgeStore, concurrency: int) -> int:
+    pool = LLMPool(OpenAI(api_key=os.getenv("OPENAI_API_KEY")), concurrency)
+    chosen = routing.Route(NUDGE_MODEL, "reengage")
+
+    async def one(user: DueUser) -> bool:
+        try:
+            text = await pool.complete(chosen, build_messages(user), max_tokens=300, temperature=0.7)
+        except Exception as e:
+            logger.error("Nudge generation failed for %s: %s", user.custom_id, e)
+            return False
+        store.save(user, text.strip())
+        return True
+
+    done = await asyncio.gather(*(one(u) for u in users))
+    return sum(done)
+
+
+def write_batch_file(users: Iterable[DueUser], path: Path) -> int:
+    """Пишет задание в формате OpenAI Batch API (JSONL, /v1/chat/completions)."""
+    n = 0
+    with path.open("w", encoding="utf-8") as f:
+        for user in users:
+            f.write(json.dumps({
+                "custom_id": user.custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": NUDGE_MODEL, "messages": build_messages(user), "max_tokens": 300},
+            }, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def run_mock_batch(input_path: Path, output_path: Path) -> None:
+    """Локальная замена Batch API: отвечает шаблоном в формате выходного файла OpenAI."""
+    with input_path.open(encoding="utf-8") as src, output_path.open("w", encoding="utf-8") as dst:
+        for line in src:
+            request = json.loads(line)
+            last_client = next(
+                (l for l in reversed(request["body"]["messages"][-1]["content"].splitlines())
+                 if l.startswith("Клиент: ")),
+                "",
+            )[len("Клиент: "):]
+            content = (
+                "Здравствуйте! Мы с вами обсуждали ваш бренд"
+                + (f" («{last_client[:60]}»)" if last_client else "")
+                + ". Давайте проведём бесплатную экспертизу обозначения — оставьте номер телефона, "
+                "и специалист свяжется с вами."
+            )
+            dst.write(json.dumps({
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}},
+            }, ensure_ascii=False) + "\n")
+
+
+def load_batch_output(output_path: Path, users: list[DueUser], store: NudgeStore) -> int:
+    by_id = {u.custom_id: u for u in users}
+    n = 0
+    with output_path.open(encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            user = by_id.get(row["custom_id"])
+            response = row.get("response") or {}
+            if user is None or response.get("status_code") != 200:
+                continue
+            store.save(user, response["body"]["choices"][0]["message"]["content"].strip())
+            n += 1
+    return n
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+def in_offpeak(hour: int, window: str = OFFPEAK_HOURS) -> bool:
+    start, _, end = window.partition("-")
+    start, end = int(start), int(end or start)
+    return start <= hour <= end if start <= end else hour >= start or hour <= end
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["archive", "vk-sessions"], required=True)
+    parser.add_argument("--mode", choices=["parallel", "mock-batch"], default="parallel")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=NUDGE_CONCURRENCY)
+    parser.add_argument("--batch-dir", type=Path, default=RENDER_DATA_DIR)
+    parser.add_argument("--force", action="store_true", help="запустить вне непиковых часов")
+    args = parser.parse_args()
+
+    setup_logging()
+    if not args.force and not in_offpeak(datetime.now().hour):
+        logger.info("Outside off-peak window %s, nothing to do", OFFPEAK_HOURS)
+        return
+
+    store = NudgeStore()
+    if args.source == "archive":
+        users = due_from_archive(ARCHIVE_DB, SILENT_AFTER_S, args.limit)
+    else:
+        users = due_from_sessions(SESSIONS_DIR, SILENT_AFTER_S, args.limit)
+    prepared = store.prepared_for("telegram" if args.source == "archive" else "vk")
+    users = [u for u in users if prepared.get(u.user_id) != u.last_seen]
+    logger.info("Due users without a prepared or sent nudge: %d", len(users))
+    if not users:
+        return
+
+    if args.mode == "parallel":
+        n = asyncio.run(generate_parallel(users, store, args.concurrency))
+    else:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        input_path = args.batch_dir / f"nudges-{stamp}.jsonl"
+        write_batch_file(users, input_path)
+        output_path = input_path.with_suffix(".out.jsonl")
+        run_mock_batch(input_path, output_path)
+        n = load_batch_output(output_path, users, store)
+    logger.info("Prepared %d nudges", n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Маршрутизация ходов между быстрой дешёвой моделью и основной OPENAI_MODEL."""
+
+from __future__ import annotations
+
+import collections
+import logging
+import os
+import re
+from typing import NamedTuple, Sequence
+
+# ---------------------------------------------------------------------------
+# Конфиг (пороги подбираются по логам маршрутизации)
+# ---------------------------------------------------------------------------
+ROUTING_ENABLED = os.getenv("MODEL_ROUTING", "1") == "1"
+FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", "gpt-4o-mini")
+STATS_EVERY = int(os.getenv("ROUTING_STATS_EVERY", "100"))  # раз в N вызовов пишем сводку
+
+logger = logging.getLogger("routing")
+
+PHONE_REGEX = re.compile(r"(\+?\d[\d\s\-]{7,}\d)")
+
+# Короткие ответы, которым не нужна «тяжёлая» модель
+_SIMPLE_RE = re.compile(
+    r"^(да|нет|ага|угу|ок|окей|хорошо|ладно|конечно|давайте|можно|есть|пока нет|"
+    r"спасибо|понятно|ясно|\+|-)[\s!.)]*$",
+    re.IGNORECASE,
+)
+# Имя в ответ на «как к вам обращаться?»: одно-два слова с заглавной буквы
+_NAME_RE = re.compile(r"^[А-ЯЁA-Z][а-яёa-z-]+(\s+[А-ЯЁA-Z][а-яёa-z-]+)?[\s!.)]*$")
+# Возражения, цена, сомнения и вопросы (в том числе без «?») — нужна основная модель
+_COMPLEX_RE = re.compile(
+    r"(дорого|не хочу|не надо|не нужно|подумаю|нет времени|не интересно|зачем|почему|"
+    r"сколько|стоимост|цена|гаранти|договор|\bсуд(ы|а|у|е|ом|ов|ам|ами|ах|ебн\w*|ит\w*)?\b|штраф|патент|конкурент|не уверен|сомнева|"
+    r"\b(как|что|если|можно|ли|когда)\b)",
+    re.IGNORECASE,
+)
+
+
+class Route(NamedTuple):
+    model: str
+    reason: str
+
+# ---------------------------------------------------------------------------
+# Классификация хода
+# ---------------------------------------------------------------------------
+def _user_turns(history: Sequence[dict]) -> int:
+    return sum(1 for m in history if m.get("role") == "user")
+
+
+def classify(user_text: str, history: Sequence[dict], has_media: bool = False) -> str:
+    """Возвращает причину выбора: simple_* → быстрая модель, остальное → основная.
+
+    history — история до текущего сообщения пользователя.
+    """
+    text = user_text.strip()
+    if has_media:
+        return "media"  # картинки разбирает основная (vision) модель
+    if _user_turns(history) == 0:
+        return "first_contact"  # приветствие с представлением Алексея — только основная модель
+    if _SIMPLE_RE.match(text):
+        return "simple_ack"  # проверяется до вопросов: «можно» целиком — согласие
+    if _COMPLEX_RE.search(text):
+        return "objection_or_pricing"
+    if "?" in text:
+        return "question"
+    if PHONE_REGEX.search(text):
+        return "simple_phone"
+    if _NAME_RE.match(text):
+        return "simple_name"
+    return "long"
+
+
+def route(user_text: str, history: Sequence[dict], main_model: str, has_media: bool = False) -> Route:
+    """Выбирает модель для хода и логирует решение."""
+    if not ROUTING_ENABLED:
+        return Route(main_model, "disabled")
+    reason = classify(user_text, history, has_media)
+    model = FAST_MODEL if reason.startswith("simple_") else main_model
+    logger.info("route model=%s reason=%s chars=%d", model, reason, len(user_text))
+    return Route(model, reason)
+
+# ---------------------------------------------------------------------------
+# Латентность по моделям
+# ---------------------------------------------------------------------------
+_latency: dict[str, collections.deque[float]] = collections.defaultdict(
+    lambda: collections.deque(maxlen=500)
+)
+_calls = 0
+
+
+def observe(chosen: Route, seconds: float) -> None:
+    """Фиксирует латентность вызова; раз в STATS_EVERY вызовов пишет сводку по моделям."""
+    global _calls
+    _latency[chosen.model].append(seconds)
+    _calls += 1
+    logger.info("llm model=%s reason=%s latency_ms=%.0f", chosen.model, chosen.reason, seconds * 1000)
+    if _calls % STATS_EVERY == 0:
+        logger.info("llm latency summary %s", latency_summary())
+
+
+def latency_summary() -> dict[str, dict[str, float]]:
+    """p50/p95 латентности (мс) по последним вызовам каждой модели."""
+    out = {}
+    for model, samples in _latency.items():
+        ordered = sorted(samples)
+        if not ordered:
+            continue
+        out[model] = {
+            "n": len(ordered),
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000),
+        }
+    return out
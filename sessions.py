@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Многоуровневая память диалогов: живые → сжатые в RAM → на диске, с прозрачной регидратацией."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+COMPACT_AFTER_S = float(os.getenv("SESSION_COMPACT_AFTER_S", str(30 * 60)))  # idle → сжатие в RAM
+EVICT_AFTER_S = float(os.getenv("SESSION_EVICT_AFTER_S", str(6 * 60 * 60)))  # idle → на диск
+
+logger = logging.getLogger("sessions")
+
+
+def prompt_version(prompt: str) -> str:
+    """Короткая ссылка на версию системного промпта вместо его копии в каждой записи."""
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+class _Packed:
+    """Сжатый диалог: zlib(JSON реплик без system) + ссылка на версию промпта."""
+
+    __slots__ = ("blob", "version", "touched")
+
+    def __init__(self, blob: bytes, version: str, touched: float) -> None:
+        self.blob = blob
+        self.version = version
+        self.touched = touched
+
+# ---------------------------------------------------------------------------
+# Менеджер сессий
+# ---------------------------------------------------------------------------
+class SessionManager:
+    """Хранит историю по user_id в трёх уровнях.
+
+    get() всегда возвращает живой list[dict] с общим system-сообщением первым
+    элементом; вызывающий код дописывает в него реплики как раньше.
+    """
+
+    def __init__(self, system_prompt: str, start_phrase: str, directory: Path) -> None:
+        self.version = prompt_version(system_prompt)
+        self.system_message = {"role": "system", "content": system_prompt}  # общий на всех
+        self.start_phrase = start_phrase
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._live: dict[int, list[dict]] = {}
+        self._touched: dict[int, float] = {}
+        self._packed: dict[int, _Packed] = {}
+
+    def __len__(self) -> int:
+        return len(self._live) + len(self._packed)
+
+    def _path(self, user_id: int) -> Path:
+        return self.directory / f"{user_id}.z"
+
+    # --- доступ -----------------------------------------------------------
+    def get(self, user_id: int) -> list[dict]:
+        """Возвращает историю пользователя, поднимая её из RAM-архива или с диска."""
+        self._touched[user_id] = time.time()
+        hist = self._live.get(user_id)
+        if hist is not None:
+            return hist
+        packed = self._packed.pop(user_id, None)
+        from_disk = packed is None
+        if from_disk:
+            packed = self._read(user_id)
+        if packed is not None:
+            hist = self._unpack(packed)
+            if from_disk:
+                # Диалог снова живой: файл удаляем, чтобы диск не рос, а офлайн-задачи
+                # (iter_hibernated) не считали вернувшегося клиента замолчавшим
+                self._path(user_id).unlink(missing_ok=True)
+        else:
+            hist = [self.system_message, {"role": "assistant", "content": self.start_phrase}]
+        self._live[user_id] = hist
+        return hist
+
+    def _unpack(self, packed: _Packed) -> list[dict]:
+        turns = json.loads(zlib.decompress(packed.blob))
+        if packed.version != self.version:
+            # Промпт сменился после рестарта — диалог продолжается с актуальным
+            logger.debug("Session prompt %s replaced by %s", packed.version, self.version)
+        return [self.system_message, *turns]
+
+    def _pack(self, hist: list[dict], touched: float) -> _Packed:
+        if hist and hist[0].get("role") == "system":
+            version = self.version if hist[0] is self.system_message else prompt_version(hist[0]["content"])
+            turns = hist[1:]
+        else:
+            version, turns = self.version, hist
+        blob = zlib.compress(json.dumps(turns, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        return _Packed(blob, version, touched)
+
+    # --- диск -------------------------------------------------------------
+    def _read(self, user_id: int) -> _Packed | None:
+        try:
+            packed = _read_file(self._path(user_id))
+        except FileNotFoundError:
+            return None
+        packed.touched = time.time()
+        return packed
+
+    def _write(self, user_id: int, packed: _Packed) -> None:
+        path = self._path(user_id)
+        tmp = path.with_suffix(".tmp")
+        header = f"{packed.version} {packed.touched:.0f}\n".encode("ascii")
+        tmp.write_bytes(header + packed.blob)
+        os.replace(tmp, path)
+
+    # --- обслуживание -----------------------------------------------------
+    def sweep(self, now: float | None = None) -> None:
+        """Сжимает простаивающие живые диалоги и выгружает давно молчащие на диск."""
+        now = now or time.time()
+        compacted = evicted = 0
+        for user_id in list(self._live):
+            touched = self._touched.get(user_id, now)
+            if now - touched >= COMPACT_AFTER_S:
+                self._packed[user_id] = self._pack(self._live.pop(user_id), touched)
+                self._touched.pop(user_id, None)
+                compacted += 1
+        for user_id, packed in list(self._packed.items()):
+            if now - packed.touched >= EVICT_AFTER_S:
+                try:
+                    self._write(user_id, packed)
+                except OSError as e:
+                    logger.error("Failed to evict session %s: %s", user_id, e)
+                    continue
+                del self._packed[user_id]
+                evicted += 1
+        if compacted or evicted:
+            logger.info(
+                "Sessions sweep: compacted=%d evicted=%d live=%d packed=%d",
+                compacted, evicted, len(self._live), len(self._packed),
+            )
+
+    def flush(self) -> int:
+        """Выгружает на диск все диалоги из RAM (перед остановкой процесса)."""
+        now = time.time()
+        for user_id in list(self._live):
+            self._packed[user_id] = self._pack(self._live.pop(user_id), self._touched.pop(user_id, now))
+        written = 0
+        for user_id, packed in list(self._packed.items()):
+            try:
+                self._write(user_id, packed)
+            except OSError as e:
+                logger.error("Failed to flush session %s: %s", user_id, e)
+                continue
+            del self._packed[user_id]
+            written += 1
+        logger.info("Sessions flushed to disk: %d", written)
+        return written
+
+
+# ---------------------------------------------------------------------------
+# Чтение выгруженных диалогов (для офлайн-задач)
+# ---------------------------------------------------------------------------
+def _read_file(path: Path) -> _Packed:
+    header, _, blob = path.read_bytes().partition(b"\n")
+    version, _, touched = header.decode("ascii").partition(" ")
+    return _Packed(blob, version, float(touched or path.stat().st_mtime))
+
+
+def iter_hibernated(directory: Path) -> Iterator[tuple[int, float, list[dict]]]:
+    """(user_id, время последней активности, реплики без system) для диалогов на диске."""
+    for path in directory.glob("*.z"):
+        try:
+            packed = _read_file(path)
+            turns = json.loads(zlib.decompress(packed.blob))
+        except (OSError, ValueError, zlib.error) as e:
+            logger.error("Skipping broken session file %s: %s", path.name, e)
+            continue
+        yield int(path.stem), packed.touched, turns
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Реестр тенантов (региональных партнёров): токены, промпт, тексты напоминаний и квоты.
+
+Каждый тенант — файл <id>.json в TENANTS_DIR:
+
+    {
+      "platform": "telegram",            # или "vk"
+      "token_env": "IZH_TG_TOKEN",       # имя переменной окружения с токеном (или "token")
+      "prompt_file": "izhevsk.txt",      # путь относительно TENANTS_DIR
+      "start_phrase": "Здравствуйте! …", # необязательно
+      "reminder_message": "…",           # необязательно: без него напоминаний нет
+      "reminder_after_s": 259200,
+      "model": "gpt-4o",                 # необязательно, иначе OPENAI_MODEL
+      "quota_per_minute": 60,
+      "enabled": true
+    }
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+logger = logging.getLogger("tenants")
+
+DEFAULT_START_PHRASE = (
+    "Здравствуйте! Пока я зову менеджера, ответьте на вопрос: "
+    "есть ли у вас уже название или логотип для вашего бизнеса?"
+)
+PLATFORMS = ("telegram", "vk")
+
+# ---------------------------------------------------------------------------
+# Квота: token bucket на тенанта
+# ---------------------------------------------------------------------------
+class Quota:
+    """Не больше per_minute вызовов модели в минуту с запасом на всплеск того же размера."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+# ---------------------------------------------------------------------------
+# Тенант
+# ---------------------------------------------------------------------------
+class Tenant:
+    def __init__(self, tenant_id: str, conf: dict, base_dir: Path, default_model: str) -> None:
+        self.id = tenant_id
+        self.platform = conf.get("platform", "telegram")
+        if self.platform not in PLATFORMS:
+            raise ValueError(f"Tenant {tenant_id}: unknown platform {self.platform!r}")
+        token = conf.get("token") or os.getenv(conf.get("token_env", ""))
+        if not token:
+            raise ValueError(f"Tenant {tenant_id}: token is not set ({conf.get('token_env')})")
+        self.token: str = token
+        prompt = conf.get("prompt")
+        if prompt is None:
+            prompt = (base_dir / conf["prompt_file"]).read_text(encoding="utf-8")
+        self.system_message = {"role": "system", "content": prompt}  # общий на все диалоги тенанта
+        self.start_phrase: str = conf.get("start_phrase", DEFAULT_START_PHRASE)
+        self.reminder_message: str | None = conf.get("reminder_message")
+        self.reminder_after_s = float(conf.get("reminder_after_s", 3 * 24 * 60 * 60))
+        self.model: str = conf.get("model", default_model)
+        self.quota = Quota(float(conf.get("quota_per_minute", 60)))
+        # Активность клиентов для напоминаний: user_id -> timestamp
+        self.last_message_time: dict[int, float] = {}
+
+    @property
+    def prompt(self) -> str:
+        return self.system_message["content"]
+
+    def touch(self, user_id: int) -> None:
+        self.last_message_time[user_id] = time.time()
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.id!r}, {self.platform})"
+
+
+def load_tenants(directory: Path, default_model: str) -> list[Tenant]:
+    """Читает все *.json из каталога; битый конфиг одного тенанта не мешает остальным."""
+    tenants = []
+    for path in sorted(directory.glob("*.json")):
+        try:
+            conf = json.loads(path.read_text(encoding="utf-8"))
+            if not conf.get("enabled", True):
+                continue
+            tenants.append(Tenant(path.stem, conf, directory, default_model))
+        except Exception as e:
+            logger.error("Failed to load tenant %s: %s", path.name, e)
+    logger.info("Loaded %d tenants from %s", len(tenants), directory)
+    return tenants
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import pytest
+
+import prefilter
+from prefilter import PreFilter
+
+
+@pytest.mark.parametrize("text", [
+    "мой сайт https://mybrand.ru",
+    "www.mybrand.com",
+    "https://t.me/ivan",
+    "vk.cc/abc",
+    "https://bit.ly/abc",
+    "МОЙ САЙТ ДЛЯ ПРОВЕРКИ НАЗВАНИЯ https://mybrand.ru",
+])
+def test_single_link_is_not_spam(text):
+    assert prefilter.spam_score(text) < prefilter.SPAM_THRESHOLD
+    assert PreFilter().check(1, text, "Как к вам обращаться?").action == "pass"
+
+
+def test_spam_keywords_with_links_are_dropped():
+    text = "Пассивный доход от крипты! Переходи https://bit.ly/x"
+    assert PreFilter().check(1, text).reason == "spam"
+
+
+def test_sequential_double_send_is_repeat():
+    pf = PreFilter()
+    assert pf.check(1, "привет", "A0").action == "pass"
+    assert pf.check(1, "привет", "reply1").reason == "repeat"
+
+
+def test_yes_to_different_questions_is_not_repeat():
+    pf = PreFilter()
+    assert pf.check(1, "да", "Есть название?").action == "pass"
+    assert pf.check(1, "да", "Продаёте на маркетплейсах?").action == "pass"
+    assert pf.check(1, "да", "Продаёте на маркетплейсах?").reason == "repeat"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(prefilter.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_retry_after_error_reply_is_not_repeat(clock):
+    pf = PreFilter()
+    text = "Сколько стоит регистрация товарного знака"
+    assert pf.check(1, text, "Есть название?").action == "pass"
+    pf.forget(1)  # ответ «Сервис временно недоступен…»
+    clock[0] += 5
+    assert pf.check(1, text, "Сервис временно недоступен, попробуем ещё раз позже.").action == "pass"
+
+
+def test_phone_resent_after_bot_asks_again_is_not_repeat(clock):
+    pf = PreFilter()
+    assert pf.check(1, "+7 999 123-45-67", "Напишите номер телефона?").action == "pass"
+    clock[0] += 40
+    assert pf.check(1, "+7 999 123-45-67", "Проверьте, пожалуйста, номер телефона?").action == "pass"
+
+
+def test_flood_on_same_bot_reply_is_repeat(clock):
+    pf = PreFilter()
+    assert pf.check(1, "хочу проверку", "Как вас зовут?").action == "pass"
+    clock[0] += 60
+    assert pf.check(1, "хочу проверку", "Как вас зовут?").reason == "repeat"
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import sessions
+from sessions import SessionManager, iter_hibernated, prompt_version
+
+
+def test_pack_evict_get_round_trip(tmp_path):
+    manager = SessionManager("PROMPT", "START", tmp_path)
+    history = manager.get(7)
+    history.extend(({"role": "user", "content": "привет"}, {"role": "assistant", "content": "Здравствуйте"}))
+    touched = manager._touched[7]
+
+    manager.sweep(now=touched + sessions.COMPACT_AFTER_S)
+    assert 7 in manager._packed and 7 not in manager._live
+
+    manager.sweep(now=touched + sessions.EVICT_AFTER_S)
+    path = tmp_path / "7.z"
+    assert path.exists() and not manager._packed
+    header = path.read_bytes().partition(b"\n")[0].decode("ascii")
+    assert header == f"{prompt_version('PROMPT')} {touched:.0f}"
+    assert [(uid, len(turns)) for uid, _, turns in iter_hibernated(tmp_path)] == [(7, 3)]
+
+    restored = manager.get(7)
+    assert restored[0] is manager.system_message
+    assert restored[1:] == [
+        {"role": "assistant", "content": "START"},
+        {"role": "user", "content": "привет"},
+        {"role": "assistant", "content": "Здравствуйте"},
+    ]
+    assert not path.exists()
+    assert list(iter_hibernated(tmp_path)) == []
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Лёгкая трассировка ходов диалога: спаны на contextvars + лог медленных ходов + сэмплирующий профайлер."""
+
+from __future__ import annotations
+
+import collections
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+SLOW_TURN_MS = float(os.getenv("SLOW_TURN_MS", "3000"))  # порог «медленного» хода
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"  # опционально для прода
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+PROFILER_REPORT_S = float(os.getenv("PROFILER_REPORT_S", "60"))
+
+logger = logging.getLogger("tracing")
+
+# ---------------------------------------------------------------------------
+# Ход диалога и спаны
+# ---------------------------------------------------------------------------
+class Turn:
+    """Один ход: от входящего сообщения до отправки ответа."""
+
+    __slots__ = ("entry", "fields", "started", "stages")
+
+    def __init__(self, entry: str, fields: dict) -> None:
+        self.entry = entry
+        self.fields = fields
+        self.started = time.monotonic()
+        self.stages: list[tuple[str, float]] = []
+
+    def breakdown(self) -> dict[str, float]:
+        """Сумма времени по этапам в миллисекундах (этап может повторяться)."""
+        out: dict[str, float] = {}
+        for stage, seconds in self.stages:
+            out[stage] = out.get(stage, 0.0) + seconds * 1000
+        return {k: round(v, 1) for k, v in out.items()}
+
+
+_current: contextvars.ContextVar[Turn | None] = contextvars.ContextVar("bebrand_turn", default=None)
+
+
+@contextmanager
+def turn(entry: str, **fields) -> Iterator[Turn]:
+    """Открывает ход; по выходу пишет разбивку по этапам, если ход оказался медленным."""
+    t = Turn(entry, fields)
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        _current.reset(token)
+        total_ms = (time.monotonic() - t.started) * 1000
+        if total_ms >= SLOW_TURN_MS:
+            record = {
+                "entry": t.entry,
+                "total_ms": round(total_ms, 1),
+                "stages": t.breakdown(),
+                **t.fields,
+            }
+            logger.warning("slow turn %s", json.dumps(record, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Замеряет этап текущего хода. Вне хода ничего не делает."""
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        t.stages.append((stage, time.monotonic() - start))
+
+
+def annotate(**fields) -> None:
+    """Добавляет поля в запись текущего хода (модель, длина ответа и т.п.)."""
+    t = _current.get()
+    if t is not None:
+        t.fields.update(fields)
+
+# ---------------------------------------------------------------------------
+# Сэмплирующий профайлер (включается PROFILER_ENABLED=1)
+# ---------------------------------------------------------------------------
+class SamplingProfiler(threading.Thread):
+    """Раз в interval снимает стек потока event loop и периодически логирует самые частые стеки."""
+
+    def __init__(self, thread_id: int, interval: float, report_every: float, depth: int = 12) -> None:
+        super().__init__(name="sampling-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.report_every = report_every
+        self.depth = depth
+        self.samples: collections.Counter[str] = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        parts = []
+        while frame is not None and len(parts) < self.depth:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        if parts:
+            self.samples[";".join(reversed(parts))] += 1
+
+    def _report(self) -> None:
+        total = sum(self.samples.values())
+        if not total:
+            return
+        top = [
+            {"share": round(n / total, 3), "stack": stack}
+            for stack, n in self.samples.most_common(10)
+        ]
+        logger.info("profile %s", json.dumps({"samples": total, "top": top}, ensure_ascii=False))
+        self.samples.clear()
+
+    def run(self) -> None:
+        next_report = time.monotonic() + self.report_every
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+            if time.monotonic() >= next_report:
+                self._report()
+                next_report = time.monotonic() + self.report_every
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+def start_profiler_from_env() -> SamplingProfiler | None:
+    """Запускает профайлер для главного потока, если он включён в окружении."""
+    if not PROFILER_ENABLED:
+        return None
+    profiler = SamplingProfiler(
+        threading.main_thread().ident,
+        PROFILER_INTERVAL_MS / 1000,
+        PROFILER_REPORT_S,
+    )
+    profiler.start()
+    logger.info("Sampling profiler started (every %.0f ms)", PROFILER_INTERVAL_MS)
+    return profiler
@@ -6,14 +6,24 @@ import asyncio
 import logging
 import os
 import time
-from collections import defaultdict
 from datetime import datetime, timedelta
+from pathlib import Path
 
 from dotenv import load_dotenv
 from openai import OpenAI
 from vkbottle.bot import Bot, Message, rules, BotLabeler
 from vkbottle import BaseMiddleware
 
+import media
+import routing
+import tracing
+import warmup
+from lifecycle import Lifecycle, TimerStore
+from logsetup import setup_logging
+from prefilter import PreFilter
+from reengage import NudgeStore
+from sessions import SessionManager
+
 # ---------------------------------------------------------------------------
 # .env и конфиг
 # ---------------------------------------------------------------------------
@@ -22,6 +32,8 @@ load_dotenv()
 VK_TOKEN = os.getenv("VK_TOKEN")  # <<< добавь в .env
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+SESSIONS_DIR = Path(os.getenv("SESSIONS_DIR", Path(os.getenv("RENDER_DATA_DIR", "/tmp")) / "vk_sessions"))
+REMINDERS_PATH = Path(os.getenv("RENDER_DATA_DIR", "/tmp")) / "vk_reminders.json"
 
 _missing = [n for n, v in [("VK_TOKEN", VK_TOKEN), ("OPENAI_API_KEY", OPENAI_API_KEY)] if not v]
 if _missing:
@@ -30,8 +42,10 @@ if _missing:
 # ---------------------------------------------------------------------------
 # Логирование
 # ---------------------------------------------------------------------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+setup_logging()
 logger = logging.getLogger(__name__)
+# Каждое событие VK — отдельный логгер, по умолчанию сэмплируется (см. LOG_SAMPLE)
+events_logger = logging.getLogger("vk_bot.events")
 
 # ---------------------------------------------------------------------------
 # OpenAI клиент (прокси берутся автоматически из HTTPS_PROXY/HTTP_PROXY)
@@ -45,8 +59,11 @@ bot = Bot(token=VK_TOKEN)
 labeler = BotLabeler()
 labeler.vbml_ignore_case = True  # не чувствителен к регистру
 
-# Память диалогов в RAM: user_id -> list[messages]
-H: dict[int, list[dict[str, str]]] = defaultdict(list)
+# Отсекает стикеры, «ок», спам и повторы до вызова OpenAI
+prefilter = PreFilter()
+
+# Фото/логотипы: уменьшение в пуле потоков и кэш по хэшу
+media_pipeline = media.MediaPipeline()
 
 # Отслеживание времени последнего сообщения от клиента: user_id -> timestamp
 last_message_time: dict[int, float] = {}
@@ -54,6 +71,21 @@ last_message_time: dict[int, float] = {}
 # Отслеживание отправленных напоминаний: user_id -> bool
 reminder_sent: dict[int, bool] = {}
 
+# Ожидающие напоминания переживают рестарт: user_id -> когда отправить
+reminders = TimerStore(REMINDERS_PATH)
+
+# SIGTERM при деплое: дождаться начатых ходов, сбросить диалоги и напоминания на диск
+lifecycle = Lifecycle()
+
+# Персональные напоминания, заранее подготовленные офлайн-задачей reengage.py
+nudges = NudgeStore()
+
+# Через сколько молчания шлём напоминание
+REMINDER_AFTER_SECONDS = 3 * 24 * 60 * 60
+
+# Через сколько молчания перестаём отслеживать клиента, если напоминание так и не ушло
+STALE_AFTER_SECONDS = 30 * 24 * 60 * 60
+
 # Текст напоминания через 3 дня
 REMINDER_MESSAGE = """Здравствуйте!) Мы с вами общались недавно. Хочу еще раз вам предложить экспертизу вашего обозначения!)
 
@@ -191,14 +223,11 @@ START_PHRASE = (
     "есть ли у вас уже название или логотип для вашего бизнеса?"
 )
 
+# Память диалогов: живые в RAM, простаивающие — сжатые, давно молчащие — на диске
+sessions = SessionManager(SYSTEM_PROMPT, START_PHRASE, SESSIONS_DIR)
+
 def _ensure_history(user_id: int) -> list[dict]:
-    hist = H[user_id]
-    if not hist:
-        hist.extend([
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "assistant", "content": START_PHRASE},
-        ])
-    return hist
+    return sessions.get(user_id)
 
 # ---------------------------------------------------------------------------
 # «Старт»: кнопка «Начать» (payload) или текст «начать / start»
@@ -206,7 +235,7 @@ def _ensure_history(user_id: int) -> list[dict]:
 @labeler.message(rules.PayloadRule({"command": "start"}))
 @labeler.message(text=["начать", "start"])
 async def cmd_start(message: Message):
-    logger.info(f"Start command from {message.from_id}")
+    logger.info("Start command from %s", message.from_id)
     user_id = message.from_id
     # Обновляем время последнего сообщения от клиента и сбрасываем флаг напоминания
     last_message_time[user_id] = time.time()
@@ -217,39 +246,56 @@ async def cmd_start(message: Message):
 # ---------------------------------------------------------------------------
 # Диалог: прокидываем историю в OpenAI и отвечаем
 # ---------------------------------------------------------------------------
-@labeler.message()  # все входящие текстовые сообщения
+@labeler.message()  # все входящие сообщения (текст, фото)
 async def handle(message: Message):
-    logger.info(f"Received message from {message.from_id}: {message.text}")
-    if not (message.text or "").strip():
-        logger.debug("Empty message text, skipping")
-        return
-
+    # Текст клиента — только на DEBUG, на INFO хватает длины
+    logger.info("Received message from %s: text_len=%d", message.from_id, len(message.text or ""))
+    logger.debug("Message text from %s: %s", message.from_id, message.text)
     user_id = message.from_id
-    # Обновляем время последнего сообщения от клиента и сбрасываем флаг напоминания
-    last_message_time[user_id] = time.time()
-    reminder_sent[user_id] = False
-    
-    history = _ensure_history(user_id)
-    history.append({"role": "user", "content": message.text.strip()})
-
-    try:
-        # Если библиотека OpenAI синхронная — просто вызываем внутри async (как у тебя в aiogram)
-        resp = oa_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=history,
-            max_tokens=500,
-            temperature=0.9,
-        )
-        reply = resp.choices[0].message.content or "…"
-    except Exception:
-        logging.exception("OpenAI API error")
-        reply = "Сервис временно недоступен, попробуем ещё раз позже."
+    with tracing.turn("vk_bot", user_id=user_id), lifecycle.turn():
+        # Обновляем время последнего сообщения от клиента и сбрасываем флаг напоминания
+        last_message_time[user_id] = time.time()
+        reminder_sent[user_id] = False
+
+        with tracing.span("media"):
+            images = await media_pipeline.from_vk(message)
+        history = _ensure_history(user_id)
+        last_assistant = history[-1]["content"] if history[-1]["role"] == "assistant" else None
+        verdict = prefilter.check(user_id, message.text or "", last_assistant, has_media=bool(images))
+        if verdict.action != "pass":
+            if verdict.reply:
+                await message.answer(verdict.reply)
+            return
+        user_text = prefilter.take_deferred(user_id, (message.text or "").strip())
+
+        chosen = routing.route(user_text, history, OPENAI_MODEL, has_media=bool(images))
+        user_message = {"role": "user", "content": media.history_text(user_text, images)}
 
-    history.append({"role": "assistant", "content": reply})
-    H[user_id] = history
-    logger.info(f"Sending reply to {user_id}: {reply[:50]}...")
-    await asyncio.sleep(0)
-    await message.answer(reply)
+        try:
+            # Если библиотека OpenAI синхронная — просто вызываем внутри async (как у тебя в aiogram)
+            started = time.monotonic()
+            with tracing.span("openai"):
+                resp = oa_client.chat.completions.create(
+                    model=chosen.model,
+                    messages=media.with_images([*history, user_message], images),
+                    max_tokens=500,
+                    temperature=0.9,
+                )
+            routing.observe(chosen, time.monotonic() - started)
+            tracing.annotate(model=chosen.model, route=chosen.reason)
+            reply = resp.choices[0].message.content or "…"
+        except Exception:
+            logging.exception("OpenAI API error")
+            reply = "Сервис временно недоступен, попробуем ещё раз позже."
+            prefilter.forget(user_id)  # повторная отправка того же текста — не флуд
+
+        # Ход дописывается целиком: прерванный вызов не оставит вопроса без ответа
+        history.extend((user_message, {"role": "assistant", "content": reply}))
+        logger.info("Sending reply to %s: reply_len=%d", user_id, len(reply))
+        logger.debug("Reply text to %s: %s", user_id, reply)
+        await asyncio.sleep(0)
+        with tracing.span("message.answer"):
+            await message.answer(reply)
 
 # ---------------------------------------------------------------------------
 # Фоновая задача для отправки напоминаний через 3 дня
@@ -260,57 +306,103 @@ async def check_and_send_reminders():
         try:
             await asyncio.sleep(6 * 60 * 60)  # Проверяем каждые 6 часов
             current_time = time.time()
-            three_days_seconds = 3 * 24 * 60 * 60  # 3 дня в секундах
             
             for user_id, last_time in list(last_message_time.items()):
                 # Проверяем, прошло ли 3 дня с момента последнего сообщения
-                if current_time - last_time >= three_days_seconds:
+                if current_time - last_time >= REMINDER_AFTER_SECONDS:
                     # Проверяем, не было ли уже отправлено напоминание
                     if not reminder_sent.get(user_id, False):
                         try:
+                            # Готовый персональный текст, если есть, иначе общий
+                            text = nudges.take("vk", user_id, last_seen=last_time) or REMINDER_MESSAGE
                             # Отправляем напоминание через API
                             await bot.api.messages.send(
                                 user_id=user_id,
-                                message=REMINDER_MESSAGE,
+                                message=text,
                                 random_id=int(time.time() * 1000) % 2147483647
                             )
                             reminder_sent[user_id] = True
                             logger.info(f"Sent reminder to user {user_id} after 3 days of silence")
                         except Exception as e:
                             logger.error(f"Failed to send reminder to user {user_id}: {e}")
+                    # Напоминание уже отправлено (или не доставляется) — больше не отслеживаем,
+                    # пока клиент не напишет снова
+                    if reminder_sent.get(user_id) or current_time - last_time >= STALE_AFTER_SECONDS:
+                        last_message_time.pop(user_id, None)
+                        reminder_sent.pop(user_id, None)
         except Exception as e:
             logger.error(f"Error in reminder check task: {e}")
 
+async def sweep_sessions():
+    """Периодически сжимает и выгружает на диск простаивающие диалоги"""
+    while True:
+        try:
+            await asyncio.sleep(60)
+            sessions.sweep()
+        except Exception as e:
+            logger.error(f"Error in sessions sweep task: {e}")
+
+def restore_reminders() -> None:
+    """Поднимает ожидающие напоминания, сохранённые при прошлой остановке"""
+    for user_id, due_at in reminders.items():
+        last_message_time.setdefault(int(user_id), due_at - REMINDER_AFTER_SECONDS)
+    logger.info("Restored %d pending reminders", len(last_message_time))
+
+def save_reminders() -> None:
+    reminders.replace({
+        str(user_id): last_time + REMINDER_AFTER_SECONDS
+        for user_id, last_time in last_message_time.items()
+        if not reminder_sent.get(user_id)
+    })
+
 # ---------------------------------------------------------------------------
-# Middleware для логирования всех событий и запуска фоновой задачи
+# Middleware для логирования всех событий
 # ---------------------------------------------------------------------------
-_reminder_task_started = False
-
 class EventLoggerMiddleware(BaseMiddleware[Message]):
     async def pre(self):
-        global _reminder_task_started
-        logger.info(f"Event received: {self.event}")
-        
-        # Запускаем фоновую задачу при первом сообщении, если она еще не запущена
-        if not _reminder_task_started:
-            try:
-                asyncio.create_task(check_and_send_reminders())
-                _reminder_task_started = True
-                logger.info("Reminder check task started via middleware")
-            except Exception as e:
-                logger.error(f"Failed to start reminder task: {e}")
-        
+        events_logger.info(
+            "Event received: peer_id=%s from_id=%s text_len=%d attachments=%d",
+            self.event.peer_id, self.event.from_id, len(self.event.text or ""), len(self.event.attachments or []),
+        )
         return True
 
 # ---------------------------------------------------------------------------
 # Точка входа
 # ---------------------------------------------------------------------------
+async def main() -> None:
+    # Пробы поднимаются сразу, события начинаем забирать только после прогрева
+    readiness = warmup.Readiness()
+    health = await warmup.serve_health(readiness)
+    await warmup.warm_up({
+        "openai": warmup.openai_check(oa_client, OPENAI_MODEL),
+        "vk": bot.api.groups.get_by_id,
+        "tokenizer": warmup.tokenizer_check(OPENAI_MODEL, SYSTEM_PROMPT),
+        "media": warmup.executor_check(media_pipeline.executor),
+    }, readiness)
+
+    # Фоновые задачи стартуют вместе с ботом, а не с первым сообщением
+    restore_reminders()
+    background = [
+        asyncio.create_task(check_and_send_reminders()),
+        asyncio.create_task(sweep_sessions()),
+    ]
+    logger.info("Reminder check and sessions sweep tasks started")
+
+    lifecycle.on_stop(lambda: setattr(readiness, "ready", False))
+    if health is not None:
+        lifecycle.on_flush("health", health.close)
+    lifecycle.on_stop(lambda: [task.cancel() for task in background])
+    lifecycle.on_flush("sessions", sessions.flush)
+    lifecycle.on_flush("reminders", save_reminders)
+    lifecycle.on_flush("nudges", nudges.close)
+    lifecycle.on_flush("media", media_pipeline.close)
+    lifecycle.on_flush("vk.http", bot.api.http_client.close)
+    await lifecycle.serve(bot.run_polling())
+
+
 if __name__ == "__main__":
     logger.info("VK bot starting…")
+    tracing.start_profiler_from_env()
     bot.labeler.load(labeler)
     bot.labeler.message_view.register_middleware(EventLoggerMiddleware)
-    
-    # Фоновая задача для напоминаний будет запущена автоматически через middleware
-    # при получении первого сообщения
-    
-    bot.run_forever()
+    asyncio.run(main())
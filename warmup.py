@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Прогрев после деплоя и пробы готовности: /livez и /readyz на HEALTH_PORT (или PORT).
+
+Пока прогрев не прошёл, /readyz отвечает 503 и бот не начинает забирать апдейты —
+первый клиент после деплоя не платит за DNS/TLS/соединения и холодные кэши.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable
+
+# ---------------------------------------------------------------------------
+# Опциональные зависимости (tiktoken)
+# ---------------------------------------------------------------------------
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None  # type: ignore
+
+# ---------------------------------------------------------------------------
+# Конфиг
+# ---------------------------------------------------------------------------
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", os.getenv("PORT", "0")))  # 0 — без HTTP-проб
+WARMUP_TIMEOUT_S = float(os.getenv("WARMUP_TIMEOUT_S", "15"))
+WARMUP_RETRY_S = float(os.getenv("WARMUP_RETRY_S", "5"))
+WARMUP_DEADLINE_S = float(os.getenv("WARMUP_DEADLINE_S", "60"))  # дальше стартуем в деградированном режиме
+WARMUP_CHAT = os.getenv("WARMUP_CHAT", "0") == "1"  # доп. крошечный chat-запрос к модели
+
+logger = logging.getLogger("warmup")
+
+Check = Callable[[], Awaitable[object]]
+
+
+class Readiness:
+    """Состояние инстанса для проб: live с момента старта, ready — после прогрева."""
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.ready = False
+        self.degraded = False  # прогрев не уложился в дедлайн, часть проверок не прошла
+        self.checks: dict[str, str] = {}
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "degraded": self.degraded,
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "checks": self.checks,
+        }
+
+# ---------------------------------------------------------------------------
+# HTTP-пробы (без зависимостей, на asyncio streams)
+# ---------------------------------------------------------------------------
+async def _serve_probe(readiness: Readiness, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass  # заголовки не нужны
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path.startswith("/livez"):
+            status, body = 200, {"live": True}
+        elif path.startswith("/readyz") or path == "/":
+            status, body = (200 if readiness.ready else 503), readiness.snapshot()
+        else:
+            status, body = 404, {"error": "not found"}
+        payload = json.dumps(body).encode()
+        reason = {200: "OK", 503: "Service Unavailable", 404: "Not Found"}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_health(readiness: Readiness, port: int = HEALTH_PORT) -> asyncio.AbstractServer | None:
+    if not port:
+        return None
+    server = await asyncio.start_server(
+        lambda r, w: _serve_probe(readiness, r, w), host="0.0.0.0", port=port
+    )
+    logger.info("Health probes on :%d (/livez, /readyz)", port)
+    return server
+
+# ---------------------------------------------------------------------------
+# Прогрев
+# ---------------------------------------------------------------------------
+async def warm_up(checks: dict[str, Check], readiness: Readiness, deadline_s: float = WARMUP_DEADLINE_S) -> None:
+    """Выполняет проверки параллельно; упавшие повторяет до дедлайна.
+
+    После дедлайна инстанс всё равно помечается готовым (degraded): ограниченный ключ
+    без models.list или недоступный tiktoken не должны мешать боту отвечать.
+    """
+    deadline = time.monotonic() + deadline_s
+    pending = dict(checks)
+    while pending:
+        names = list(pending)
+        results = await asyncio.gather(
+            *(asyncio.wait_for(pending[name](), WARMUP_TIMEOUT_S) for name in names),
+            return_exceptions=True,
+        )
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                readiness.checks[name] = f"error: {result!r}"[:200]
+                logger.warning("Warm-up check %s failed: %r", name, result)
+            else:
+                readiness.checks[name] = "ok"
+                del pending[name]
+        if pending:
+            if time.monotonic() + WARMUP_RETRY_S >= deadline:
+                readiness.degraded = True
+                logger.error("Warm-up deadline reached, starting degraded; failed: %s", ", ".join(pending))
+                break
+            await asyncio.sleep(WARMUP_RETRY_S)
+    readiness.ready = True
+    logger.info("Warm-up done in %.1fs", time.monotonic() - readiness.started)
+
+# ---------------------------------------------------------------------------
+# Типовые проверки
+# ---------------------------------------------------------------------------
+def openai_check(client, model: str) -> Check:
+    """Открывает keep-alive соединение пула клиента (models.list, по желанию — крошечный chat)."""
+    async def check() -> None:
+        await asyncio.to_thread(client.models.list)
+        if WARMUP_CHAT:
+            await asyncio.to_thread(
+                client.chat.completions.create,
+                model=model,
+                messages=[{"role": "user", "content": "ping"}],
+                max_tokens=1,
+            )
+    return check
+
+
+def tokenizer_check(model: str, prompt: str) -> Check:
+    """Загружает BPE-таблицы tiktoken (если установлен) и один раз кодирует промпт."""
+    async def check() -> int:
+        if tiktoken is None:
+            return 0
+        def encode() -> int:
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")
+            return len(enc.encode(prompt))
+        return await asyncio.to_thread(encode)
+    return check
+
+
+def executor_check(executor) -> Check:
+    """Поднимает воркеры пула обработки картинок заранее."""
+    async def check() -> None:
+        await asyncio.get_running_loop().run_in_executor(executor, int)
+    return check